@@ -0,0 +1,111 @@
+"""Control de admisión: límites por cliente y por usuario con token buckets, y descarte por prioridad.
+
+Cada petición gasta de dos cubetas, la del cliente y la del usuario (si
+trae ``user_id``), una cantidad de fichas según lo que cuesta atender su
+endpoint: un ranking completo cuesta más que una predicción. Si alguna no
+alcanza, se responde 429 de inmediato con el tiempo de espera. Aparte, si
+hay demasiadas peticiones en curso se descartan primero las de menor
+prioridad con 503, antes de que se acumulen y suban la latencia de todos.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Fracción de ``max_in_flight`` a partir de la cual se descarta cada prioridad
+# (0 = la más importante, solo se descarta con la capacidad completa)
+SHED_LEVELS = (1.0, 0.9, 0.75, 0.5)
+# Cubetas recordadas por tipo; se olvidan primero las usadas hace más tiempo
+MAX_TRACKED_KEYS = 100000
+
+
+class TokenBucket:
+    """Cubeta de ``burst`` fichas que se rellena a ``rate`` fichas por segundo"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, cost):
+        """Segundos hasta tener ``cost`` fichas (0 si ya alcanzan)"""
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+
+class AdmissionController:
+    """Decide si se atiende cada petición y cuenta las descartadas por endpoint"""
+
+    def __init__(self, client_rate=50.0, client_burst=100.0, user_rate=10.0, user_burst=30.0, max_in_flight=32):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+        self._users = OrderedDict()
+        self._in_flight = 0
+        self.admitted = 0
+        self.rate_limited = {}
+        self.shed = {}
+
+    def _bucket(self, buckets, key, rate, burst, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+            if len(buckets) > MAX_TRACKED_KEYS:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+            bucket.refill(now)
+        return bucket
+
+    def admit(self, endpoint, client_id, user_id=None, cost=1.0, priority=1):
+        """None si se atiende, o ``(estado, segundos para reintentar)`` si se rechaza.
+
+        Cada petición admitida debe cerrarse con ``release()``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._in_flight >= self.max_in_flight * SHED_LEVELS[min(priority, len(SHED_LEVELS) - 1)]:
+                self.shed[endpoint] = self.shed.get(endpoint, 0) + 1
+                return 503, 1
+
+            buckets = [self._bucket(self._clients, client_id, self.client_rate, self.client_burst, now)]
+            if user_id is not None:
+                buckets.append(self._bucket(self._users, user_id, self.user_rate, self.user_burst, now))
+            # Se cobra en todas las cubetas o en ninguna
+            wait = max(bucket.wait_for(cost) for bucket in buckets)
+            if wait > 0:
+                self.rate_limited[endpoint] = self.rate_limited.get(endpoint, 0) + 1
+                return 429, max(1, math.ceil(wait))
+            for bucket in buckets:
+                bucket.tokens -= min(cost, bucket.burst)
+
+            self._in_flight += 1
+            self.admitted += 1
+        return None
+
+    def release(self):
+        """Marcar como terminada una petición admitida"""
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        """Peticiones en curso y rechazadas (429 por límite, 503 por sobrecarga) por endpoint"""
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "rate_limited": dict(self.rate_limited),
+                "shed": dict(self.shed),
+                "tracked_clients": len(self._clients),
+                "tracked_users": len(self._users),
+            }
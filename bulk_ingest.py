@@ -0,0 +1,112 @@
+"""Carga masiva de clasificaciones en formato NDJSON (una clasificación por línea).
+
+Cada línea se valida con las mismas reglas que ``/rate/joke``; las válidas
+se aplican al almacén por lotes y cada lote se persiste una sola vez. La
+entrada se procesa línea por línea, sin cargarla entera en memoria.
+
+La API expone lo mismo en ``POST /rate/jokes/bulk``. Este script hace la
+carga offline, con la API detenida, sobre los mismos archivos:
+    python bulk_ingest.py historico.ndjson [--batch-size 1000]
+    cat historico.ndjson | python bulk_ingest.py -
+"""
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from data_export import parse_time
+from rating_store import append_log, parse_rating
+from scoring import HISTORY_SIZE
+from tiered_store import TieredRatingStore
+
+RATINGS_DB_FILE = "user_ratings.db"
+RATINGS_LOG_FILE = "ratings_log.ndjson"
+BULK_BATCH_SIZE = 1000
+# Cantidad máxima de errores detallados en el reporte
+MAX_REPORTED_ERRORS = 1000
+
+
+def parse_timestamp(value):
+    """Hora ISO normalizada de una línea (la actual si no trae); ValueError si no es válida"""
+    if value is None or value == "":
+        return datetime.now().isoformat()
+    if not isinstance(value, str):
+        raise ValueError(f"timestamp inválido: {value!r}")
+    try:
+        return parse_time(value).isoformat()
+    except ValueError:
+        raise ValueError(f"timestamp inválido: {value!r}")
+
+
+def ingest_ndjson(lines, store, persist_batch, batch_size=BULK_BATCH_SIZE):
+    """Validar y aplicar clasificaciones NDJSON por lotes; devuelve un reporte por línea.
+
+    ``lines`` puede ser cualquier iterable de líneas (bytes o str).
+    ``persist_batch(records)`` se llama una vez por lote ya aplicado.
+    Cada línea puede traer su propio ``timestamp`` ISO; si no, se usa la hora actual.
+    Los que traen zona horaria se pasan a hora local sin zona, como el resto del historial.
+    """
+    report = {"accepted": 0, "rejected": 0, "batches": 0, "errors": []}
+    batch = []
+
+    def flush():
+        for record in batch:
+            store.add(record["user_id"], record["joke_id"], record["rating"], record["timestamp"])
+        persist_batch(batch)
+        report["accepted"] += len(batch)
+        report["batches"] += 1
+        batch.clear()
+
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+            user_id, joke_id, rating = parse_rating(data)
+            timestamp = parse_timestamp(data.get("timestamp"))
+        except ValueError as e:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"line": line_number, "error": str(e)})
+            continue
+
+        batch.append({"user_id": user_id, "joke_id": joke_id, "rating": rating, "timestamp": timestamp})
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    report["errors_truncated"] = report["rejected"] > len(report["errors"])
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cargar clasificaciones NDJSON sin pasar por la API")
+    parser.add_argument("input", help="Archivo NDJSON o '-' para leer de la entrada estándar")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--ratings-db", default=RATINGS_DB_FILE)
+    parser.add_argument("--log-file", default=RATINGS_LOG_FILE)
+    args = parser.parse_args()
+
+    store = TieredRatingStore(args.ratings_db, maxlen=HISTORY_SIZE)
+
+    def persist_batch(records):
+        append_log(records, args.log_file)
+        store.flush()
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r")
+    try:
+        report = ingest_ndjson(source, store, persist_batch, batch_size=args.batch_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        store.close()
+
+    print(f"✅ {report['accepted']} clasificaciones cargadas en {report['batches']} lotes")
+    if report["rejected"]:
+        print(f"⚠️ {report['rejected']} líneas rechazadas")
+        for error in report["errors"]:
+            print(f"   línea {error['line']}: {error['error']}")
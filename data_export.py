@@ -0,0 +1,148 @@
+"""Exportación en streaming del historial de clasificaciones y de los perfiles.
+
+Todo se arma con generadores que leen el archivo de origen línea por línea
+y emiten NDJSON o CSV por bloques, así que la memoria usada no depende del
+tamaño de los datos. La API lo expone en ``/export/ratings`` y
+``/export/profiles`` solo con la clave de administración (``X-Admin-Token``),
+porque incluye datos personales; este script hace lo mismo desde la línea
+de comandos, sobre los archivos locales:
+    python data_export.py ratings --format csv --since 2024-01-01 > ratings.csv
+    python data_export.py profiles --user-min 1000 --user-max 1999
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+RATINGS_LOG_FILE = "ratings_log.ndjson"
+USER_PROFILES_FILE = "user_profiles.csv"
+EXPORT_FORMATS = ("ndjson", "csv")
+# Filas por bloque al exportar en CSV
+CSV_CHUNK_ROWS = 500
+
+RATING_FIELDS = ["user_id", "joke_id", "rating", "timestamp"]
+PROFILE_FIELDS = ["user_id", "edad", "genero", "nacionalidad", "profesion",
+                  "fecha_creacion", "ultima_actualizacion"]
+
+
+def parse_time(value):
+    """Convertir una fecha ISO (o None) para filtrar por rango de tiempo"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    # El historial guarda horas locales sin zona; comparar en esa misma referencia
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def _in_user_range(user_id, user_min, user_max):
+    return (user_min is None or user_id >= user_min) and (user_max is None or user_id <= user_max)
+
+
+def iter_ratings(path=RATINGS_LOG_FILE, since=None, until=None, user_min=None, user_max=None):
+    """Clasificaciones del historial filtradas por rango de tiempo [since, until) y de usuarios"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                user_id = int(record["user_id"])
+            except (ValueError, KeyError, TypeError):
+                continue  # Saltar líneas dañadas
+            if not _in_user_range(user_id, user_min, user_max):
+                continue
+            if since is not None or until is not None:
+                try:
+                    timestamp = parse_time(record["timestamp"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if timestamp is None:
+                    continue
+                if (since is not None and timestamp < since) or (until is not None and timestamp >= until):
+                    continue
+            yield {field: record.get(field) for field in RATING_FIELDS}
+
+
+def iter_profiles(path=USER_PROFILES_FILE, user_min=None, user_max=None):
+    """Perfiles demográficos filtrados por rango de usuarios"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                user_id = int(float(row["user_id"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+            if _in_user_range(user_id, user_min, user_max):
+                row["user_id"] = user_id
+                yield {field: row.get(field) for field in PROFILE_FIELDS}
+
+
+def to_ndjson(records):
+    """Una línea JSON por registro"""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def to_csv(records, fields, chunk_rows=CSV_CHUNK_ROWS):
+    """CSV con encabezado, emitido en bloques de ``chunk_rows`` filas"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    rows = 0
+    for record in records:
+        writer.writerow(record)
+        rows += 1
+        if rows >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export(kind, fmt="ndjson", since=None, until=None, user_min=None, user_max=None,
+           ratings_path=RATINGS_LOG_FILE, profiles_path=USER_PROFILES_FILE):
+    """Generador de texto exportado para ``kind`` ('ratings' o 'profiles') en el formato pedido"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato inválido: {fmt} (usar {', '.join(EXPORT_FORMATS)})")
+    if kind == "ratings":
+        records, fields = iter_ratings(ratings_path, since, until, user_min, user_max), RATING_FIELDS
+    elif kind == "profiles":
+        records, fields = iter_profiles(profiles_path, user_min, user_max), PROFILE_FIELDS
+    else:
+        raise ValueError(f"Tipo de exportación inválido: {kind}")
+    return to_csv(records, fields) if fmt == "csv" else to_ndjson(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportar clasificaciones o perfiles en streaming")
+    parser.add_argument("kind", choices=["ratings", "profiles"])
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--since", default=None, help="Fecha ISO inicial (incluida)")
+    parser.add_argument("--until", default=None, help="Fecha ISO final (excluida)")
+    parser.add_argument("--user-min", type=int, default=None)
+    parser.add_argument("--user-max", type=int, default=None)
+    parser.add_argument("--ratings-file", default=RATINGS_LOG_FILE)
+    parser.add_argument("--profiles-file", default=USER_PROFILES_FILE)
+    parser.add_argument("--output", default=None, help="Archivo de salida (por defecto, salida estándar)")
+    args = parser.parse_args()
+
+    chunks = export(args.kind, args.format, parse_time(args.since), parse_time(args.until),
+                    args.user_min, args.user_max, args.ratings_file, args.profiles_file)
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,276 @@
+"""Evaluación offline de la lógica de predicción y recomendación de la API.
+
+Reproduce un archivo de clasificaciones reservadas (CSV o NDJSON con
+user_id, joke_id, rating) repartiendo bloques de usuarios entre varios
+procesos. Para cada clasificación predice como ``/predict/jokes``: la
+estimación base del modelo más el sesgo de las últimas clasificaciones del
+usuario (las anteriores en el archivo), recortado al rango válido. Para
+cada usuario ordena el catálogo con el mismo código que ``/recommend/jokes``
+(la tabla top-K para los usuarios del modelo y ``rank_catalog`` con los
+factores en ``--precision`` para el resto) y mide precision@k y NDCG@k
+contra los chistes que calificó por encima del umbral.
+
+Los bloques se arman por usuario en orden determinístico, así que dos
+corridas sobre el mismo modelo y archivo dan las mismas métricas.
+
+Con ``--compare-precision`` compara en cambio los factores de ítems
+cuantizados (ver ``FactorScorer``) contra los de precisión completa: error
+de las predicciones base, coincidencia del top-k, memoria y latencia por
+usuario. Termina con código 1 si se superan las tolerancias de
+``PRECISION_TOLERANCES``.
+
+Uso:
+    python evaluate_model.py heldout.csv [--model svd_model2.pkl] [--k 10]
+                             [--precision int8] [--no-topk]
+                             [--workers 4] [--output reporte.json]
+    python evaluate_model.py --compare-precision int8 [--model svd_model2.pkl]
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from scoring import (FACTOR_PRECISIONS, HISTORY_SIZE, FactorScorer, adjust_rating, preference_bias,
+                     rank_catalog)
+from topk_recommendations import TOPK_FILE, file_fingerprint, load_or_build
+from train_model import iter_ratings
+
+MODEL_FILE = "svd_model2.pkl"
+JOKES_FILE = "jokes.csv"
+USERS_PER_CHUNK = 200
+
+# Tolerancias frente a float64: (RMSE máximo de las predicciones base en
+# puntos de rating, coincidencia mínima promedio del top-k)
+PRECISION_TOLERANCES = {
+    "float32": (0.001, 0.99),
+    "float16": (0.01, 0.95),
+    "int8": (0.05, 0.90),
+}
+COMPARE_USERS = 2000
+
+# Estado de cada proceso trabajador
+_model = None
+_joke_ids = None
+_scorer = None
+_table = None
+
+
+def _init_worker(model_path, joke_ids, precision, table):
+    global _model, _joke_ids, _scorer, _table
+    with open(model_path, "rb") as f:
+        _model = pickle.load(f)
+    _joke_ids = joke_ids
+    _scorer = FactorScorer(_model, joke_ids, precision=precision) if FactorScorer.supports(_model) else None
+    _table = table
+
+
+def _top_jokes(user_id, user_bias, k):
+    """Los ``k`` primeros chistes para un usuario, por el mismo camino que /recommend/jokes"""
+    ranked = _table.rank(user_id, user_bias, k) if _table is not None else None
+    if ranked is None and _scorer is not None:
+        ranked = rank_catalog(_scorer, user_id, user_bias, k)
+    if ranked is None:
+        predictions = [(joke_id, round(adjust_rating(_model.predict(user_id, joke_id).est, user_bias), 3))
+                       for joke_id in _joke_ids]
+        ranked = sorted(predictions, key=lambda p: p[1], reverse=True)[:k]
+    return [joke_id for joke_id, _ in ranked]
+
+
+def _evaluate_chunk(users, k, threshold):
+    """Métricas parciales de un bloque de usuarios [(user_id, [(joke_id, rating), ...]), ...]"""
+    squared_error = 0.0
+    absolute_error = 0.0
+    predictions = 0
+    precision_sum = 0.0
+    ndcg_sum = 0.0
+    ranked_users = 0
+
+    start = time.perf_counter()
+    for user_id, ratings in users:
+        history = deque(maxlen=HISTORY_SIZE)
+        for joke_id, rating in ratings:
+            user_bias = preference_bias(history)
+            predicted = adjust_rating(_model.predict(user_id, joke_id).est, user_bias)
+            error = predicted - rating
+            squared_error += error * error
+            absolute_error += abs(error)
+            predictions += 1
+            history.append(rating)
+    predict_seconds = time.perf_counter() - start
+
+    for user_id, ratings in users:
+        relevant = {joke_id for joke_id, rating in ratings if rating >= threshold}
+        if not relevant:
+            continue
+        history = [rating for _, rating in ratings[-HISTORY_SIZE:]]
+        top = _top_jokes(user_id, preference_bias(history), k)
+        hits = [1 if joke_id in relevant else 0 for joke_id in top]
+        precision_sum += sum(hits) / k
+        dcg = sum(hit / math.log2(pos + 2) for pos, hit in enumerate(hits))
+        ideal = sum(1 / math.log2(pos + 2) for pos in range(min(len(relevant), k)))
+        ndcg_sum += dcg / ideal
+        ranked_users += 1
+
+    return {
+        "squared_error": squared_error,
+        "absolute_error": absolute_error,
+        "predictions": predictions,
+        "predict_seconds": predict_seconds,
+        "precision_sum": precision_sum,
+        "ndcg_sum": ndcg_sum,
+        "ranked_users": ranked_users,
+    }
+
+
+def group_by_user(path):
+    """Agrupar las clasificaciones por usuario respetando el orden del archivo"""
+    users = {}
+    for user_id, joke_id, rating in iter_ratings(path):
+        users.setdefault(user_id, []).append((joke_id, rating))
+    return sorted(users.items())
+
+
+def evaluate(ratings_path, model_path=MODEL_FILE, jokes_path=JOKES_FILE, k=10, threshold=5.0, workers=None,
+             precision="float64", topk_path=TOPK_FILE):
+    """Correr la evaluación completa y devolver un reporte comparable entre corridas.
+
+    ``topk_path=None`` ordena todo con ``rank_catalog``, sin la tabla top-K.
+    """
+    joke_ids = pd.read_csv(jokes_path)["joke_id"].astype(int).tolist()
+    table = None
+    if topk_path:
+        with open(model_path, "rb") as f:
+            model = pickle.load(f)
+        table = load_or_build(model, joke_ids, file_fingerprint(model_path), path=topk_path)
+    users = group_by_user(ratings_path)
+    chunks = [users[i:i + USERS_PER_CHUNK] for i in range(0, len(users), USERS_PER_CHUNK)]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model_path, joke_ids, precision, table)) as pool:
+        partials = list(pool.map(_evaluate_chunk, chunks, [k] * len(chunks), [threshold] * len(chunks)))
+    elapsed = time.perf_counter() - start
+
+    totals = {key: sum(p[key] for p in partials) for key in partials[0]} if partials else {}
+    predictions = totals.get("predictions", 0)
+    ranked_users = totals.get("ranked_users", 0)
+    predict_seconds = totals.get("predict_seconds", 0.0)
+
+    return {
+        "model": os.path.basename(model_path),
+        "model_version": file_fingerprint(model_path),
+        "ratings_file": os.path.basename(ratings_path),
+        "ratings_version": file_fingerprint(ratings_path),
+        "users": len(users),
+        "predictions": predictions,
+        "rmse": round(math.sqrt(totals["squared_error"] / predictions), 4) if predictions else None,
+        "mae": round(totals["absolute_error"] / predictions, 4) if predictions else None,
+        "k": k,
+        "relevance_threshold": threshold,
+        "precision": precision,
+        "topk_table": table is not None,
+        "ranked_users": ranked_users,
+        f"precision@{k}": round(totals["precision_sum"] / ranked_users, 4) if ranked_users else None,
+        f"ndcg@{k}": round(totals["ndcg_sum"] / ranked_users, 4) if ranked_users else None,
+        "workers": workers or os.cpu_count(),
+        "predictions_per_second_per_worker": round(predictions / predict_seconds, 1) if predict_seconds else None,
+        "elapsed_seconds": round(elapsed, 3),
+    }
+
+
+def _latency_ms(scorer, user_ids):
+    """Milisegundos promedio para puntuar el catálogo de un usuario"""
+    start = time.perf_counter()
+    for user_id in user_ids:
+        scorer.score_user(user_id)
+    return (time.perf_counter() - start) * 1000 / len(user_ids)
+
+
+def compare_precision(precision, model_path=MODEL_FILE, jokes_path=JOKES_FILE, k=10, max_users=COMPARE_USERS):
+    """Comparar los factores cuantizados contra float64 sobre los usuarios del modelo"""
+    joke_ids = pd.read_csv(jokes_path)["joke_id"].astype(int).tolist()
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    if not FactorScorer.supports(model):
+        raise ValueError("El modelo no expone factores latentes")
+
+    full = FactorScorer(model, joke_ids)
+    quantized = FactorScorer(model, joke_ids, precision=precision)
+    # Muestra determinística de usuarios conocidos
+    user_ids = sorted(full.known_users())[:max_users]
+
+    reference = full.score_users(user_ids)
+    approx = quantized.score_users(user_ids)
+    k = min(k, len(joke_ids))
+    top_ref = np.argsort(-reference, axis=1, kind="stable")[:, :k]
+    top_approx = np.argsort(-approx, axis=1, kind="stable")[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(top_ref, top_approx)])
+
+    max_rmse, min_overlap = PRECISION_TOLERANCES.get(precision, (0.0, 1.0))
+    rmse_value = float(np.sqrt(np.mean(np.square(approx - reference))))
+    return {
+        "model": os.path.basename(model_path),
+        "model_version": file_fingerprint(model_path),
+        "precision": precision,
+        "users": len(user_ids),
+        "catalog_size": len(joke_ids),
+        "rmse_vs_float64": round(rmse_value, 6),
+        "max_abs_error": round(float(np.max(np.abs(approx - reference))), 6),
+        f"top{k}_overlap": round(float(overlap), 4),
+        "item_factor_bytes_float64": full.item_factor_bytes(),
+        f"item_factor_bytes_{precision}": quantized.item_factor_bytes(),
+        "latency_ms_float64": round(_latency_ms(full, user_ids), 4),
+        f"latency_ms_{precision}": round(_latency_ms(quantized, user_ids), 4),
+        "max_rmse": max_rmse,
+        "min_overlap": min_overlap,
+        "within_tolerance": bool(rmse_value <= max_rmse and overlap >= min_overlap),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluar el modelo offline sobre clasificaciones reservadas")
+    parser.add_argument("ratings", nargs="?", help="Archivo CSV o NDJSON con user_id, joke_id y rating")
+    parser.add_argument("--model", default=MODEL_FILE)
+    parser.add_argument("--jokes", default=JOKES_FILE)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=5.0, help="Rating mínimo para considerar un chiste relevante")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Guardar el reporte en JSON")
+    parser.add_argument("--compare-precision", choices=FACTOR_PRECISIONS[1:], default=None,
+                        help="Comparar factores cuantizados contra float64 en lugar de evaluar")
+    parser.add_argument("--compare-users", type=int, default=COMPARE_USERS)
+    parser.add_argument("--precision", choices=FACTOR_PRECISIONS,
+                        default=os.environ.get("ITEM_FACTOR_PRECISION", "float64"),
+                        help="Factores del ranking en vivo, como ITEM_FACTOR_PRECISION en la API")
+    parser.add_argument("--topk-file", default=TOPK_FILE, help="Tabla top-K que usa la API")
+    parser.add_argument("--no-topk", action="store_true", help="Ordenar todo en vivo, sin la tabla top-K")
+    args = parser.parse_args()
+
+    if args.compare_precision:
+        report = compare_precision(args.compare_precision, args.model, args.jokes,
+                                   k=args.k, max_users=args.compare_users)
+    elif args.ratings:
+        report = evaluate(args.ratings, args.model, args.jokes, k=args.k,
+                          threshold=args.threshold, workers=args.workers, precision=args.precision,
+                          topk_path=None if args.no_topk else args.topk_file)
+    else:
+        parser.error("falta el archivo de clasificaciones (o --compare-precision)")
+    for key, value in report.items():
+        print(f"   {key}: {value}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Reporte guardado en {args.output}")
+
+    if args.compare_precision and not report["within_tolerance"]:
+        print("❌ La precisión reducida supera las tolerancias")
+        sys.exit(1)
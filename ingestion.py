@@ -0,0 +1,190 @@
+"""Cola acotada de ingesta de clasificaciones con escritura agrupada (group commit)"""
+import queue
+import threading
+import time
+
+# Modos de durabilidad:
+#   "async": se responde al encolar; la escritura ocurre en el próximo lote
+#   "sync":  se responde cuando el lote que contiene la clasificación llegó a disco
+DURABILITY_MODES = ("async", "sync")
+
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """La cola de ingesta está llena; el cliente debe reintentar más tarde"""
+
+
+class _Pending:
+    def __init__(self, record, apply=None):
+        self.record = record
+        self.apply = apply
+        # Se marca cuando el registro ya está en memoria (o no hay que aplicarlo)
+        self.applied = threading.Event()
+        self.cancelled = False
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitWriter:
+    """Escritor en segundo plano que persiste las clasificaciones por lotes.
+
+    ``commit_fn(records)`` recibe la lista de registros de un lote y debe
+    dejarlos en almacenamiento durable. Un lote se cierra al juntar
+    ``batch_size`` registros o al pasar ``batch_ms`` milisegundos desde el
+    primero, lo que ocurra antes.
+    """
+
+    def __init__(self, commit_fn, max_queue=10000, batch_size=100, batch_ms=50, durability="async"):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Modo de durabilidad inválido: {durability}")
+        self.commit_fn = commit_fn
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.durability = durability
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.committed = 0
+        self.batches = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="rating-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record, apply=None):
+        """Encolar un registro; en modo sync espera a que su lote se escriba.
+
+        ``apply`` actualiza la memoria con el registro. En modo async se
+        ejecuta aquí, en paralelo con otros envíos, y el escritor espera a
+        que termine antes de persistir el lote que lo contiene. En modo
+        sync lo ejecuta el escritor, en orden, solo si el lote se escribió:
+        una clasificación que falló no queda visible.
+        """
+        if self._closed:
+            raise QueueFullError("La ingesta está cerrada")
+        pending = _Pending(record, apply)
+        if apply is None or self.durability == "sync":
+            pending.applied.set()
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise QueueFullError("Cola de ingesta llena")
+
+        if self.durability == "async" and apply is not None:
+            try:
+                apply()
+            except Exception:
+                pending.cancelled = True
+                raise
+            finally:
+                pending.applied.set()
+        with self._stats_lock:
+            self.accepted += 1
+
+        if self.durability == "sync":
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+        return pending
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.batch_ms / 1000.0
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+        # Vaciar lo que haya quedado encolado antes del cierre
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.batch_size):
+            self._commit(leftover[start:start + self.batch_size])
+
+    def _commit(self, batch):
+        # Esperar a que los registros del lote terminen de aplicarse en memoria
+        for pending in batch:
+            pending.applied.wait()
+        batch = [p for p in batch if not p.cancelled]
+        if not batch:
+            return
+        error = None
+        try:
+            self.commit_fn([p.record for p in batch])
+        except Exception as e:
+            error = e
+            print(f"❌ Error escribiendo lote de {len(batch)} clasificaciones: {e}")
+        with self._stats_lock:
+            self.batches += 1
+            if error is None:
+                self.committed += len(batch)
+            else:
+                self.failed += len(batch)
+        for pending in batch:
+            pending.error = error
+            if error is None and self.durability == "sync" and pending.apply is not None:
+                try:
+                    pending.apply()
+                except Exception as e:
+                    pending.error = e
+            pending.done.set()
+
+    def flush(self, timeout=None):
+        """Esperar a que se escriba todo lo aceptado hasta ahora; devuelve False si venció el plazo"""
+        with self._stats_lock:
+            target = self.accepted
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._stats_lock:
+                # Los lotes salen en orden de llegada: alcanzar la cuenta alcanza
+                if self.committed + self.failed >= target:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(max(self.batch_ms, 10) / 2000.0)
+
+    def close(self, timeout=None):
+        """Dejar de aceptar registros y esperar a que se escriba todo lo pendiente"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        """Contadores de la cola de ingesta"""
+        with self._stats_lock:
+            return {
+                "durability": self.durability,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "committed": self.committed,
+                "failed": self.failed,
+                "batches": self.batches,
+            }
@@ -1,24 +1,124 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import pickle
+import atexit
+import hmac
 import json
 import os
+import threading
+import time
 from datetime import datetime
-from collections import defaultdict, deque
 import pandas as pd
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from admission import AdmissionController
+from bulk_ingest import BULK_BATCH_SIZE, ingest_ndjson
+from data_export import export, parse_time
+from ingestion import GroupCommitWriter, QueueFullError
+from rating_store import append_log, load_snapshot, parse_rating, purge_log
+from scoring import HISTORY_SIZE, FactorScorer, adjust_rating, preference_bias, rank_catalog
+from request_trace import TraceRecorder
+from singleflight import SingleFlight
+from tiered_store import TieredRatingStore
+from topk_recommendations import FORK_AVAILABLE, catalog_fingerprint, file_fingerprint, load_or_build
+
 app = Flask("jokes_recommendation_api")
 
-# Archivo para guardar las clasificaciones de usuarios
-RATINGS_FILE = "user_ratings.json"
+# Dirección de la instancia y carpeta de sus datos por usuario; en modo shard
+# (ver shard_router.py) cada instancia usa su propio puerto y carpeta
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", 5017))
+DATA_DIR = os.environ.get("DATA_DIR", ".")
+os.makedirs(DATA_DIR, exist_ok=True)
+# Clave para los endpoints /admin; sin clave quedan desactivados (responden 403)
+SHARD_ADMIN_TOKEN = os.environ.get("SHARD_ADMIN_TOKEN", "")
+
+# Clasificaciones de usuarios: base SQLite y la instantánea JSON anterior (se migra una vez)
+RATINGS_DB_FILE = os.path.join(DATA_DIR, "user_ratings.db")
+RATINGS_FILE = os.path.join(DATA_DIR, "user_ratings.json")
+# Historial completo (una clasificación por línea), escrito por lotes
+RATINGS_LOG_FILE = os.path.join(DATA_DIR, "ratings_log.ndjson")
+MODEL_FILE = "svd_model2.pkl"
+# Perfiles demográficos que guarda la app de Streamlit
+USER_PROFILES_FILE = "user_profiles.csv"
+
+# Campos de cada recomendación; el modo compacto devuelve solo ids y ratings
+RECOMMENDATION_FIELDS = ("joke_id", "predicted_rating", "joke_text")
+COMPACT_FIELDS = ("joke_id", "predicted_rating")
+
+# Caché HTTP: las respuestas por usuario se revalidan siempre con su ETag;
+# /stats puede servirse desde un proxy local durante unos segundos
+USER_CACHE_CONTROL = "public, no-cache"
+STATS_MAX_AGE = int(os.environ.get("STATS_MAX_AGE", 5))
+
+# Ingesta de clasificaciones: "async" responde al encolar, "sync" al escribir en disco
+RATING_DURABILITY = os.environ.get("RATING_DURABILITY", "async")
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 100))
+INGEST_BATCH_MS = int(os.environ.get("INGEST_BATCH_MS", 50))
+
+# Traza anonimizada de peticiones para replay_trace.py (vacío = desactivada)
+REQUEST_TRACE_FILE = os.environ.get("REQUEST_TRACE_FILE", "")
+REQUEST_TRACE_MAX_BYTES = int(os.environ.get("REQUEST_TRACE_MAX_BYTES", 50 * 1024 * 1024))
+REQUEST_TRACE_BACKUPS = int(os.environ.get("REQUEST_TRACE_BACKUPS", 5))
+REQUEST_TRACE_SALT = os.environ.get("REQUEST_TRACE_SALT")
+
+# Usuarios que se mantienen en memoria; los demás se leen de RATINGS_DB_FILE al consultarlos
+RATING_CACHE_USERS = int(os.environ.get("RATING_CACHE_USERS", 100000))
+
+# Representación de los factores de ítems para el ranking en vivo
+# ("float64", "float32", "float16" o "int8"; ver evaluate_model.py --compare-precision)
+ITEM_FACTOR_PRECISION = os.environ.get("ITEM_FACTOR_PRECISION", "float64")
+
+# Control de admisión (ver admission.py): fichas por segundo y ráfaga por cliente
+# (X-Client-Id o IP) y por usuario, y peticiones simultáneas antes de descartar.
+# Desactivado por defecto: detrás del túnel (loca.lt) todas las conexiones llegan
+# desde 127.0.0.1, así que todos los clientes compartirían una sola cubeta, y
+# confiar en 127.0.0.1 aceptaría cualquier X-Client-Id inventado. Activarlo
+# (ADMISSION_ENABLED=1) cuando la API reciba las conexiones de los clientes, o
+# detrás de un proxy propio listado en TRUSTED_PROXIES que reescriba X-Forwarded-For.
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "0") == "1"
+# Direcciones de los proxies (router, Streamlit) cuyos X-Client-Id y X-Forwarded-For
+# se creen, separadas por comas; de cualquier otra se usa la dirección de la conexión
+TRUSTED_PROXIES = {a.strip() for a in os.environ.get("TRUSTED_PROXIES", "").split(",") if a.strip()}
+CLIENT_RATE = float(os.environ.get("CLIENT_RATE", 50))
+CLIENT_BURST = float(os.environ.get("CLIENT_BURST", 100))
+USER_RATE = float(os.environ.get("USER_RATE", 10))
+USER_BURST = float(os.environ.get("USER_BURST", 30))
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 32))
+# Fichas que cuesta cada endpoint y su prioridad al descartar (0 = la más alta)
+ENDPOINT_COSTS = {
+    "/": 0.5,
+    "/predict/jokes": 1,
+    "/user/ratings": 1,
+    "/rate/joke": 1,
+    "/stats": 1,
+    "/recommend/jokes": 3,
+    "/rate/jokes/bulk": 20,
+}
+ENDPOINT_PRIORITIES = {
+    "/rate/joke": 0,
+    "/": 1,
+    "/predict/jokes": 1,
+    "/user/ratings": 1,
+    "/stats": 2,
+    "/recommend/jokes": 2,
+    "/rate/jokes/bulk": 3,
+}
+# Un ranking con más chistes que la tabla top-K recorre todo el catálogo
+FULL_RANKING_COST = 10
 
 # Cargar el modelo entrenado
 try:
-    with open("svd_model2.pkl", "rb") as f:
+    with open(MODEL_FILE, "rb") as f:
         model = pickle.load(f)
     print("✅ Modelo SVD cargado exitosamente desde svd_model.pkl")
 except FileNotFoundError:
     try:
-        with open("svd_model2.pkl", "rb") as f:
+        with open(MODEL_FILE, "rb") as f:
             model = pickle.load(f)
         print("✅ Modelo SVD cargado exitosamente desde svd_model2.pkl")
     except FileNotFoundError:
@@ -33,63 +133,203 @@ except FileNotFoundError:
     print("❌ Error: No se encontró el archivo jokes.csv")
     jokes_df = None
 
+# Versión del modelo cargado (cambia solo si cambia el archivo del modelo)
+model_version = file_fingerprint(MODEL_FILE) if model is not None else None
+
+# Las secuencias de escritura por usuario se reinician al arrancar; la época las distingue
+server_epoch = format(int(time.time()), "x")
+
+# Versión del catálogo de chistes (para las ETags de respuestas que lo incluyen)
+catalog_version = catalog_fingerprint(jokes_df['joke_id'].tolist()) if jokes_df is not None else None
+
+# Textos de chistes indexados por id para no filtrar el DataFrame por cada chiste
+joke_texts = dict(zip(jokes_df['joke_id'], jokes_df['joke_text'])) if jokes_df is not None else {}
+
+# Tabla precalculada de top-K por usuario conocido (se recalcula si cambió el modelo o el catálogo).
+# Sin fork se calcula en este proceso: los trabajadores no deben volver a importar la API.
+topk_table = None
+if model is not None and jokes_df is not None:
+    try:
+        topk_table = load_or_build(model, jokes_df['joke_id'].tolist(), model_version,
+                                   workers=None if FORK_AVAILABLE else 0)
+    except Exception as e:
+        print(f"⚠️ Error calculando tabla top-K, se usará el cálculo en vivo: {e}")
+
+# Puntuación vectorizada del catálogo para el ranking en vivo (usuarios fuera de la tabla)
+live_scorer = None
+if model is not None and jokes_df is not None and FactorScorer.supports(model):
+    try:
+        live_scorer = FactorScorer(model, jokes_df['joke_id'].tolist(), precision=ITEM_FACTOR_PRECISION)
+        print(f"✅ Factores de ítems en {ITEM_FACTOR_PRECISION} ({live_scorer.item_factor_bytes()} bytes)")
+    except ValueError as e:
+        print(f"⚠️ {e}; se predice chiste por chiste")
+
+# Cálculos de recomendación en curso, compartidos entre peticiones idénticas
+recommendation_flight = SingleFlight()
+
 # Estructura para guardar las últimas 3 clasificaciones por usuario
-# Formato: {user_id: deque([(joke_id, rating, timestamp), ...], maxlen=3)}
-user_ratings = defaultdict(lambda: deque(maxlen=3))
+# Formato: {user_id: ((joke_id, rating, timestamp), ...)} con locks por franja de usuarios;
+# en memoria solo los usuarios activos, el resto en disco
+rating_store = TieredRatingStore(RATINGS_DB_FILE, max_hot_users=RATING_CACHE_USERS, maxlen=HISTORY_SIZE)
+persist_lock = threading.Lock()
 
 def load_user_ratings():
-    """Cargar las clasificaciones guardadas desde archivo"""
-    global user_ratings
-    if os.path.exists(RATINGS_FILE):
+    """Migrar la instantánea JSON anterior a la base (los usuarios se cargan al consultarlos)"""
+    if os.path.exists(RATINGS_FILE) and len(rating_store) == 0:
         try:
-            with open(RATINGS_FILE, 'r') as f:
-                data = json.load(f)
-                for user_id, ratings_list in data.items():
-                    user_ratings[int(user_id)] = deque(
-                        [(r['joke_id'], r['rating'], r['timestamp']) for r in ratings_list],
-                        maxlen=3
-                    )
-            print(f"✅ Clasificaciones de usuarios cargadas desde {RATINGS_FILE}")
+            load_snapshot(rating_store, RATINGS_FILE)
+            os.replace(RATINGS_FILE, RATINGS_FILE + ".migrated")
+            print(f"✅ Clasificaciones de {RATINGS_FILE} migradas a {RATINGS_DB_FILE}")
         except Exception as e:
-            print(f"⚠️ Error cargando clasificaciones: {e}")
+            print(f"⚠️ Error migrando clasificaciones: {e}")
+    print(f"✅ {len(rating_store)} usuarios con clasificaciones en {RATINGS_DB_FILE}")
 
 def save_user_ratings():
-    """Guardar las clasificaciones actuales en archivo"""
+    """Escribir en la base los usuarios con clasificaciones pendientes"""
     try:
-        data = {}
-        for user_id, ratings_deque in user_ratings.items():
-            data[str(user_id)] = [
-                {
-                    'joke_id': joke_id,
-                    'rating': rating,
-                    'timestamp': timestamp
-                }
-                for joke_id, rating, timestamp in ratings_deque
-            ]
-        
-        with open(RATINGS_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-        print(f"💾 Clasificaciones guardadas en {RATINGS_FILE}")
+        rating_store.flush()
     except Exception as e:
         print(f"❌ Error guardando clasificaciones: {e}")
 
+def persist_ratings(records):
+    """Escribir un lote de clasificaciones: historial en disco y luego la base"""
+    # El escritor en segundo plano y la carga masiva comparten los archivos
+    with persist_lock:
+        append_log(records, RATINGS_LOG_FILE)
+        save_user_ratings()
+
 def get_user_preference_bias(user_id):
     """Calcular el sesgo de preferencia del usuario basado en sus últimas clasificaciones"""
-    if user_id not in user_ratings or len(user_ratings[user_id]) == 0:
-        return 0.0  # Sin sesgo para usuarios nuevos
-    
-    ratings = [rating for _, rating, _ in user_ratings[user_id]]
-    avg_rating = sum(ratings) / len(ratings)
-    
-    # Convertir a escala -10 a 10 (asumiendo que la app envía 0-10)
-    # Si el usuario tiende a dar ratings altos, sesgo positivo
-    # Si tiende a dar ratings bajos, sesgo negativo
-    bias = (avg_rating - 5.0) * 2  # Escalar de 0-10 a -10,10
-    return bias
+    return preference_bias([rating for _, rating, _ in rating_store.get(user_id)])
 
 # Cargar clasificaciones al iniciar
 load_user_ratings()
 
+# Escritor en segundo plano; al cerrar el proceso se vacía la cola y luego se cierra la base
+atexit.register(rating_store.close)
+rating_writer = GroupCommitWriter(
+    persist_ratings,
+    max_queue=INGEST_QUEUE_SIZE,
+    batch_size=INGEST_BATCH_SIZE,
+    batch_ms=INGEST_BATCH_MS,
+    durability=RATING_DURABILITY
+)
+atexit.register(rating_writer.close)
+
+request_trace = None
+if REQUEST_TRACE_FILE:
+    request_trace = TraceRecorder(REQUEST_TRACE_FILE, max_bytes=REQUEST_TRACE_MAX_BYTES,
+                                  backups=REQUEST_TRACE_BACKUPS, salt=REQUEST_TRACE_SALT)
+    atexit.register(request_trace.close)
+    print(f"📝 Registrando peticiones en {REQUEST_TRACE_FILE}")
+
+@app.before_request
+def start_trace_timer():
+    if request_trace is not None:
+        g.trace_start = time.perf_counter()
+        g.trace_ts = time.time()
+
+@app.after_request
+def record_trace(response):
+    """Agregar la petición a la traza (si está activada) sin afectar la respuesta"""
+    if request_trace is not None and "trace_start" in g:
+        try:
+            body = request.get_json(silent=True) if request.path == "/rate/joke" else None
+            request_trace.record(request.method, request.path, request.args.to_dict(), body,
+                                 response.status_code, (time.perf_counter() - g.trace_start) * 1000,
+                                 ts=g.trace_ts, client=request_client_id())
+        except Exception as e:
+            print(f"⚠️ Error registrando la petición: {e}")
+    return response
+
+admission = AdmissionController(CLIENT_RATE, CLIENT_BURST, USER_RATE, USER_BURST,
+                                MAX_IN_FLIGHT) if ADMISSION_ENABLED else None
+
+def request_user_id():
+    """user_id de la petición (parámetro o cuerpo de /rate/joke), o None si no trae uno válido"""
+    value = request.args.get("user_id")
+    if value is None and request.path == "/rate/joke":
+        data = request.get_json(silent=True)
+        value = data.get("user_id") if isinstance(data, dict) else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def request_client_id():
+    """Cliente que hace la petición, para los límites de admisión y la traza.
+
+    Los encabezados solo valen si la conexión viene de ``TRUSTED_PROXIES``;
+    si no, un cliente podría estrenar una cubeta en cada petición.
+    """
+    remote = request.remote_addr
+    if remote not in TRUSTED_PROXIES:
+        return remote
+    client_id = request.headers.get("X-Client-Id")
+    if client_id:
+        return client_id
+    # El cliente es la última dirección que no sea de un proxy de confianza
+    for address in reversed(request.access_route):
+        if address not in TRUSTED_PROXIES:
+            return address
+    return remote
+
+@app.before_request
+def admit_request():
+    """Rechazar enseguida (429/503) lo que supere los límites o la capacidad, antes de hacer trabajo"""
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    if admission is None or rule not in ENDPOINT_COSTS:
+        return None
+    # Las tareas del operador (cargas y exportaciones con la clave) no compiten con el tráfico
+    if admin_allowed():
+        return None
+    
+    cost = ENDPOINT_COSTS[rule]
+    if rule == "/recommend/jokes":
+        # Sin fila en la tabla top-K (más chistes que k, o usuario que el modelo no
+        # conoce) el ranking recorre todo el catálogo
+        top_n = request.args.get("top_n", 5, type=int) or 5
+        user_id = request_user_id()
+        if (topk_table is None or top_n > topk_table.k
+                or (user_id is not None and topk_table.lookup(user_id) is None)):
+            cost = FULL_RANKING_COST
+    rejected = admission.admit(rule, request_client_id(), request_user_id(), cost, ENDPOINT_PRIORITIES.get(rule, 1))
+    if rejected is not None:
+        status, retry_after = rejected
+        if status == 429:
+            response = jsonify({"error": "Demasiadas peticiones, reintenta en unos segundos"})
+        else:
+            response = jsonify({"error": "Servidor saturado, reintenta en unos segundos"})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, status
+    g.admitted = True
+
+@app.teardown_request
+def release_request(exc):
+    if g.pop("admitted", False):
+        admission.release()
+
+def user_etag(user_id, version=None):
+    """ETag de una respuesta por usuario: cambia con el modelo, el catálogo o sus clasificaciones.
+
+    ``version`` es la versión de sus clasificaciones ya leída (si no, se lee ahora).
+    """
+    if version is None:
+        version = rating_store.user_version(user_id)
+    return f"{model_version}-{catalog_version}-{server_epoch}-{user_id}-{version}"
+
+def not_modified(etag):
+    """Respuesta 304 si el cliente (o el proxy) ya tiene esta versión, sin recalcular nada"""
+    if request.if_none_match.contains(etag):
+        return with_cache_headers(Response(status=304), etag)
+    return None
+
+def with_cache_headers(response, etag, cache_control=USER_CACHE_CONTROL):
+    """Agregar ETag y Cache-Control a una respuesta"""
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
 @app.route("/", methods=["GET"])
 def hello_world():
     return jsonify({
@@ -98,8 +338,11 @@ def hello_world():
         "endpoints": {
             "/predict/jokes": "GET - Predecir rating de un chiste",
             "/rate/joke": "POST - Clasificar un chiste",
+            "/rate/jokes/bulk": "POST - Cargar clasificaciones masivas en NDJSON",
             "/recommend/jokes": "GET - Obtener mejores chistes para usuario",
-            "/user/ratings": "GET - Ver últimas clasificaciones del usuario"
+            "/user/ratings": "GET - Ver últimas clasificaciones del usuario",
+            "/export/ratings": "GET - Exportar historial de clasificaciones (NDJSON/CSV, requiere X-Admin-Token)",
+            "/export/profiles": "GET - Exportar perfiles de usuarios (NDJSON/CSV, requiere X-Admin-Token)"
         }
     })
 
@@ -113,25 +356,29 @@ def predict_joke():
         if model is None:
             return jsonify({"error": "Modelo no disponible"}), 500
         
+        # La predicción solo cambia con el modelo o las clasificaciones del usuario
+        etag = user_etag(user_id)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
         # Predicción base del modelo
         pred = model.predict(user_id, joke_id)
         base_rating = pred.est
         
         # Aplicar sesgo de preferencia del usuario
         user_bias = get_user_preference_bias(user_id)
-        adjusted_rating = base_rating + (user_bias * 0.3)  # Factor de ajuste
+        # Factor de ajuste y recorte al rango válido
+        adjusted_rating = adjust_rating(base_rating, user_bias)
         
-        # Mantener en rango válido
-        adjusted_rating = max(-10, min(10, adjusted_rating))
-        
-        return jsonify({
+        return with_cache_headers(jsonify({
             "user_id": user_id,
             "joke_id": joke_id,
             "predicted_rating": round(adjusted_rating, 3),
             "base_prediction": round(base_rating, 3),
             "user_bias": round(user_bias, 3),
-            "user_ratings_count": len(user_ratings.get(user_id, []))
-        })
+            "user_ratings_count": len(rating_store.get(user_id))
+        }), etag)
         
     except ValueError:
         return jsonify({"error": "user_id y joke_id deben ser números enteros"}), 400
@@ -142,28 +389,34 @@ def predict_joke():
 def rate_joke():
     """Guardar la clasificación de un usuario para un chiste"""
     try:
-        data = request.get_json()
-        user_id = int(data.get("user_id"))
-        joke_id = int(data.get("joke_id"))
-        rating = float(data.get("rating"))
-        
-        # Validar rating en escala 0-10
-        if not (0 <= rating <= 10):
-            return jsonify({"error": "Rating debe estar entre 0 y 10"}), 400
+        # Validar ids enteros y rating en escala 0-10
+        try:
+            user_id, joke_id, rating = parse_rating(request.get_json())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Guardar la clasificación con timestamp
         timestamp = datetime.now().isoformat()
-        user_ratings[user_id].append((joke_id, rating, timestamp))
+        record = {"user_id": user_id, "joke_id": joke_id, "rating": rating, "timestamp": timestamp}
         
-        # Guardar en archivo
-        save_user_ratings()
+        # Encolar para escritura agrupada; la memoria se actualiza al aceptar (async)
+        # o cuando su lote llegó a disco (sync)
+        try:
+            rating_writer.submit(
+                record,
+                apply=lambda: rating_store.add(user_id, joke_id, rating, timestamp)
+            )
+        except QueueFullError:
+            response = jsonify({"error": "Servidor saturado, reintenta en unos segundos"})
+            response.headers["Retry-After"] = "1"
+            return response, 503
         
         return jsonify({
             "message": "Clasificación guardada exitosamente",
             "user_id": user_id,
             "joke_id": joke_id,
             "rating": rating,
-            "total_ratings": len(user_ratings[user_id]),
+            "total_ratings": len(rating_store.get(user_id)),
             "timestamp": timestamp
         })
         
@@ -172,6 +425,125 @@ def rate_joke():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/rate/jokes/bulk", methods=["POST"])
+def rate_jokes_bulk():
+    """Cargar clasificaciones en NDJSON (una por línea) leyendo el cuerpo en streaming"""
+    try:
+        batch_size = int(request.args.get("batch_size", BULK_BATCH_SIZE))
+        if batch_size < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "batch_size debe ser un entero positivo"}), 400
+    
+    try:
+        # Se valida línea por línea y se persiste una vez por lote
+        report = ingest_ndjson(request.stream, rating_store, persist_ratings, batch_size=batch_size)
+        return jsonify(report)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def build_recommendations(user_id, top_n):
+    """Calcular el ranking de chistes de un usuario ajustado por su sesgo"""
+    user_bias = get_user_preference_bias(user_id)
+    
+    # Usuarios conocidos por el modelo: servir desde la tabla precalculada.
+    # El resto: todo el catálogo en un solo producto matriz-vector (ver evaluate_model.py,
+    # que mide con estas mismas funciones)
+    ranked = topk_table.rank(user_id, user_bias, top_n) if topk_table is not None else None
+    evaluated = topk_table.catalog_size if ranked is not None else None
+    if ranked is None and live_scorer is not None:
+        ranked = rank_catalog(live_scorer, user_id, user_bias, top_n)
+        evaluated = len(live_scorer.joke_ids)
+    if ranked is not None:
+        recommendations = [
+            {
+                'joke_id': joke_id,
+                'predicted_rating': predicted_rating,
+                'joke_text': joke_texts.get(joke_id, "N/A")
+            }
+            for joke_id, predicted_rating in ranked
+        ]
+        return {
+            "user_id": user_id,
+            "recommendations": recommendations,
+            "user_bias": round(user_bias, 3),
+            "user_ratings_count": len(rating_store.get(user_id)),
+            "total_jokes_evaluated": evaluated
+        }
+    
+    # Obtener todos los joke_ids disponibles
+    all_joke_ids = jokes_df['joke_id'].tolist()
+    
+    # Predecir ratings para todos los chistes
+    predictions = []
+    
+    for joke_id in all_joke_ids:
+        try:
+            pred = model.predict(user_id, joke_id)
+            base_rating = pred.est
+            adjusted_rating = adjust_rating(base_rating, user_bias)
+            
+            # Obtener el texto del chiste
+            joke_text = joke_texts[joke_id]
+            
+            predictions.append({
+                'joke_id': joke_id,
+                'predicted_rating': round(adjusted_rating, 3),
+                'joke_text': joke_text
+            })
+        except:
+            continue  # Saltar chistes que causen error
+    
+    # Ordenar por rating predicho (descendente) y tomar top_n
+    recommendations = sorted(predictions, key=lambda x: x['predicted_rating'], reverse=True)[:top_n]
+    
+    return {
+        "user_id": user_id,
+        "recommendations": recommendations,
+        "user_bias": round(user_bias, 3),
+        "user_ratings_count": len(rating_store.get(user_id)),
+        "total_jokes_evaluated": len(predictions)
+    }
+
+def parse_response_options(args):
+    """Leer los campos pedidos y el largo máximo del texto para las recomendaciones"""
+    if args.get("compact", "0").lower() in ("1", "true"):
+        fields = COMPACT_FIELDS
+    elif args.get("fields"):
+        fields = tuple(f.strip() for f in args["fields"].split(",") if f.strip())
+        unknown = [f for f in fields if f not in RECOMMENDATION_FIELDS]
+        if unknown:
+            raise ValueError(f"Campos inválidos: {', '.join(unknown)} (usar {', '.join(RECOMMENDATION_FIELDS)})")
+    else:
+        fields = RECOMMENDATION_FIELDS
+    
+    text_len = args.get("text_len")
+    if text_len is not None:
+        try:
+            text_len = int(text_len)
+        except ValueError:
+            raise ValueError("text_len debe ser un entero no negativo")
+        if text_len < 0:
+            raise ValueError("text_len debe ser un entero no negativo")
+    return fields, text_len
+
+def shape_recommendations(recommendations, fields, text_len=None):
+    """Quedarse con los campos pedidos y recortar el texto de cada chiste"""
+    shaped = [{field: rec[field] for field in fields} for rec in recommendations]
+    if text_len is not None and "joke_text" in fields:
+        for rec in shaped:
+            if len(rec["joke_text"]) > text_len:
+                rec["joke_text"] = rec["joke_text"][:text_len] + "..."
+    return shaped
+
+def json_response(payload, status=200):
+    """Serializar respuestas grandes sin ordenar claves (con orjson si está instalado)"""
+    if orjson is not None:
+        body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return Response(body, status=status, mimetype="application/json")
+
 @app.route("/recommend/jokes", methods=["GET"])
 def recommend_jokes():
     """Recomendar los mejores chistes para un usuario"""
@@ -182,41 +554,30 @@ def recommend_jokes():
         if model is None or jokes_df is None:
             return jsonify({"error": "Modelo o datos de chistes no disponibles"}), 500
         
-        # Obtener todos los joke_ids disponibles
-        all_joke_ids = jokes_df['joke_id'].tolist()
-        
-        # Predecir ratings para todos los chistes
-        predictions = []
-        user_bias = get_user_preference_bias(user_id)
-        
-        for joke_id in all_joke_ids:
-            try:
-                pred = model.predict(user_id, joke_id)
-                base_rating = pred.est
-                adjusted_rating = base_rating + (user_bias * 0.3)
-                adjusted_rating = max(-10, min(10, adjusted_rating))
-                
-                # Obtener el texto del chiste
-                joke_text = jokes_df[jokes_df['joke_id'] == joke_id]['joke_text'].iloc[0]
-                
-                predictions.append({
-                    'joke_id': joke_id,
-                    'predicted_rating': round(adjusted_rating, 3),
-                    'joke_text': joke_text
-                })
-            except:
-                continue  # Saltar chistes que causen error
+        # La versión se lee una sola vez: la misma va en el ETag y en la clave del
+        # cálculo compartido, para no servir con un ETag nuevo un resultado que
+        # empezó a calcularse antes de la última clasificación
+        version = rating_store.user_version(user_id)
+        etag = user_etag(user_id, version)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
         
-        # Ordenar por rating predicho (descendente) y tomar top_n
-        recommendations = sorted(predictions, key=lambda x: x['predicted_rating'], reverse=True)[:top_n]
+        # Las peticiones idénticas simultáneas (doble clic, varias pestañas)
+        # esperan al mismo cálculo en curso en lugar de repetirlo
+        result, _ = recommendation_flight.do(
+            (user_id, top_n, model_version, version),
+            lambda: build_recommendations(user_id, top_n)
+        )
         
-        return jsonify({
-            "user_id": user_id,
-            "recommendations": recommendations,
-            "user_bias": round(user_bias, 3),
-            "user_ratings_count": len(user_ratings.get(user_id, [])),
-            "total_jokes_evaluated": len(predictions)
-        })
+        # Forma de la respuesta: ?compact=1 (solo ids y ratings), ?fields=... y ?text_len=N
+        try:
+            fields, text_len = parse_response_options(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if fields != RECOMMENDATION_FIELDS or text_len is not None:
+            result = dict(result, recommendations=shape_recommendations(result["recommendations"], fields, text_len))
+        return with_cache_headers(json_response(result), etag)
         
     except ValueError:
         return jsonify({"error": "user_id debe ser un número entero"}), 400
@@ -229,24 +590,25 @@ def get_user_ratings():
     try:
         user_id = int(request.args.get("user_id"))
         
-        if user_id not in user_ratings:
-            return jsonify({
+        etag = user_etag(user_id)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        user_history = rating_store.get(user_id)
+        if not user_history:
+            return with_cache_headers(jsonify({
                 "user_id": user_id,
                 "ratings": [],
                 "total_ratings": 0,
                 "message": "Usuario sin clasificaciones previas"
-            })
+            }), etag)
         
         # Convertir a formato legible
         ratings_list = []
-        for joke_id, rating, timestamp in user_ratings[user_id]:
+        for joke_id, rating, timestamp in user_history:
             # Obtener texto del chiste si está disponible
-            joke_text = "N/A"
-            if jokes_df is not None:
-                try:
-                    joke_text = jokes_df[jokes_df['joke_id'] == joke_id]['joke_text'].iloc[0]
-                except:
-                    pass
+            joke_text = joke_texts.get(joke_id, "N/A")
             
             ratings_list.append({
                 "joke_id": joke_id,
@@ -255,31 +617,181 @@ def get_user_ratings():
                 "joke_text": joke_text[:100] + "..." if len(joke_text) > 100 else joke_text
             })
         
-        return jsonify({
+        return with_cache_headers(jsonify({
             "user_id": user_id,
             "ratings": ratings_list,
             "total_ratings": len(ratings_list),
             "average_rating": round(sum(r["rating"] for r in ratings_list) / len(ratings_list), 2) if ratings_list else 0
-        })
+        }), etag)
         
     except ValueError:
         return jsonify({"error": "user_id debe ser un número entero"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/export/<kind>", methods=["GET"])
+def export_data(kind):
+    """Exportar clasificaciones o perfiles en streaming (NDJSON o CSV por bloques).
+
+    Son datos personales de todos los usuarios: se exige la clave de
+    administración. Sin acceso a ella, ``data_export.py`` exporta offline.
+    """
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    try:
+        fmt = request.args.get("format", "ndjson")
+        since = parse_time(request.args.get("since"))
+        until = parse_time(request.args.get("until"))
+        user_min = request.args.get("user_min", type=int)
+        user_max = request.args.get("user_max", type=int)
+        
+        chunks = export(kind, fmt, since, until, user_min, user_max,
+                        ratings_path=RATINGS_LOG_FILE, profiles_path=USER_PROFILES_FILE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={kind}.{fmt}"
+    return response
+
+def admin_allowed():
+    """La petición trae la clave de administración (nunca, si no hay una configurada)"""
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(SHARD_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), SHARD_ADMIN_TOKEN.encode())
+
+@app.route("/admin/flush", methods=["POST"])
+def admin_flush():
+    """Esperar a que todas las clasificaciones aceptadas estén en disco (antes de exportar)"""
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    if not rating_writer.flush(timeout=30):
+        return jsonify({"error": "La cola de ingesta no se vació a tiempo"}), 503
+    return jsonify({"flushed": True, "ingestion": rating_writer.stats()})
+
+# Usuarios por bloque al exportarlos para un rebalanceo
+ADMIN_EXPORT_CHUNK = 500
+
+@app.route("/admin/users", methods=["GET"])
+def admin_export_users():
+    """Clasificaciones vigentes de todos los usuarios en NDJSON, para moverlos a otro shard.
+
+    Sale de la base de usuarios y no del historial, así que incluye a los
+    que nunca pasaron por él (p. ej. los migrados de ``user_ratings.json``).
+    """
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    
+    def chunks():
+        lines = []
+        for user_id, version, ratings in rating_store.iter_users():
+            lines.append(json.dumps({"user_id": user_id, "version": version,
+                                     "ratings": [list(r) for r in ratings]}) + "\n")
+            if len(lines) >= ADMIN_EXPORT_CHUNK:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+    
+    return Response(stream_with_context(chunks()), mimetype="application/x-ndjson")
+
+@app.route("/admin/users", methods=["POST"])
+def admin_import_users():
+    """Cargar usuarios exportados con ``GET /admin/users`` (reemplaza a esos usuarios, sin tocar el historial)"""
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    data = {}
+    versions = {}
+    try:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            user_id = int(record["user_id"])
+            data[user_id] = [(int(j), float(r), str(t)) for j, r, t in record["ratings"]]
+            versions[user_id] = int(record.get("version", 0))
+    except (TypeError, KeyError, ValueError):
+        return jsonify({"error": "Se requiere NDJSON con user_id y ratings [[joke_id, rating, timestamp], ...]"}), 400
+    
+    # Conservar la secuencia de escrituras de cada usuario, para que sus ETags no se repitan
+    rating_store.load(data, versions=versions)
+    return jsonify({"loaded_users": len(data)})
+
+@app.route("/admin/log", methods=["GET"])
+def admin_export_log():
+    """Historial de clasificaciones completo en NDJSON, para moverlo a otro shard"""
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    return Response(stream_with_context(export("ratings", ratings_path=RATINGS_LOG_FILE)),
+                    mimetype="application/x-ndjson")
+
+@app.route("/admin/log", methods=["POST"])
+def admin_append_log():
+    """Agregar al historial registros de otro shard (no cambia las clasificaciones vigentes)"""
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    records = []
+    try:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            user_id, joke_id, rating = parse_rating(data)
+            records.append({"user_id": user_id, "joke_id": joke_id, "rating": rating,
+                            "timestamp": str(data["timestamp"])})
+    except (TypeError, KeyError, ValueError):
+        return jsonify({"error": "Se requiere NDJSON con user_id, joke_id, rating y timestamp"}), 400
+    
+    with persist_lock:
+        append_log(records, RATINGS_LOG_FILE)
+    return jsonify({"appended": len(records)})
+
+@app.route("/admin/purge", methods=["POST"])
+def admin_purge():
+    """Quitar usuarios de esta instancia (memoria, base e historial) después de moverlos a otro shard"""
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    try:
+        user_ids = [int(u) for u in request.get_json()["user_ids"]]
+    except (TypeError, KeyError, ValueError):
+        return jsonify({"error": "Se requiere user_ids (lista de enteros)"}), 400
+    
+    with persist_lock:
+        removed_users = rating_store.remove(user_ids)
+        removed_ratings = purge_log(RATINGS_LOG_FILE, set(user_ids))
+    return jsonify({"removed_users": removed_users, "removed_ratings": removed_ratings})
+
 @app.route("/stats", methods=["GET"])
 def get_stats():
     """Obtener estadísticas generales del sistema"""
-    total_users = len(user_ratings)
-    total_ratings = sum(len(ratings) for ratings in user_ratings.values())
+    # Contadores incrementales: costo constante sin importar la cantidad de usuarios.
+    # Con ?detail=1 se agregan conteos por chiste e histograma de ratings.
+    detail = request.args.get("detail", "0").lower() in ("1", "true")
+    rating_stats = rating_store.stats(detail=detail)
     
-    return jsonify({
-        "total_users_with_ratings": total_users,
-        "total_ratings_stored": total_ratings,
+    response = {
+        "total_users_with_ratings": rating_stats["total_users"],
+        "total_ratings_stored": rating_stats["total_ratings"],
+        "ratings_last_minute": rating_stats["ratings_last_minute"],
         "jokes_available": len(jokes_df) if jokes_df is not None else 0,
         "model_loaded": model is not None,
-        "data_loaded": jokes_df is not None
-    })
+        "data_loaded": jokes_df is not None,
+        "rating_cache": rating_stats["cache"],
+        "recommendation_coalescing": recommendation_flight.stats(),
+        "ingestion": rating_writer.stats(),
+        "admission": admission.stats() if admission is not None else None
+    }
+    if detail:
+        response["ratings_per_joke"] = rating_stats["ratings_per_joke"]
+        response["rating_histogram"] = rating_stats["rating_histogram"]
+    
+    # Calcularlas es barato; la ETag del contenido evita reenviar el cuerpo si no cambió
+    response = jsonify(response)
+    response.add_etag()
+    response.headers["Cache-Control"] = f"public, max-age={STATS_MAX_AGE}"
+    return response.make_conditional(request)
 
 if __name__ == "__main__":
     print("🚀 Iniciando API de Recomendación de Chistes...")
@@ -287,7 +799,8 @@ if __name__ == "__main__":
     print("   - Predicciones personalizadas basadas en historial")
     print("   - Almacenamiento de últimas 3 clasificaciones por usuario")
     print("   - Recomendaciones ajustadas por preferencias del usuario")
-    print("   - Persistencia de datos en user_ratings.json")
-    print(f"🌐 Servidor corriendo en http://127.0.0.1:5017")
+    print(f"   - Persistencia de datos en {RATINGS_DB_FILE} ({RATING_CACHE_USERS} usuarios en memoria)")
+    print(f"   - Historial completo en {RATINGS_LOG_FILE} (escritura por lotes, modo {RATING_DURABILITY})")
+    print(f"🌐 Servidor corriendo en http://{API_HOST}:{API_PORT}")
     
-    app.run(debug=True, host="127.0.0.1", port=5017) 
+    app.run(debug=True, host=API_HOST, port=API_PORT, threaded=True) 
@@ -0,0 +1,176 @@
+"""Almacén en memoria de las últimas clasificaciones por usuario, seguro entre hilos"""
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# Ventana para el cálculo de clasificaciones por minuto
+RATE_WINDOW_SECONDS = 60
+
+
+class RatingStore:
+    """Últimas ``maxlen`` clasificaciones de cada usuario.
+
+    Cada usuario guarda una tupla inmutable de ``(joke_id, rating, timestamp)``.
+    Las escrituras toman un lock por franja de usuarios (varios usuarios
+    comparten franja) y reemplazan la tupla completa (copy-on-write), de modo
+    que las lecturas nunca bloquean ni ven una lista a medio modificar.
+
+    Los agregados (totales, conteos por chiste, histograma y clasificaciones
+    por minuto) se mantienen incrementalmente en cada inserción y desalojo,
+    así que consultarlos no recorre a los usuarios.
+    """
+
+    def __init__(self, maxlen=3, stripes=64):
+        self.maxlen = maxlen
+        self._users = {}
+        self._user_versions = {}
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._stats_lock = threading.Lock()
+        self._total_ratings = 0
+        self._joke_counts = {}
+        self._histogram = [0] * 11
+        self._recent = deque()  # [(segundo, cantidad), ...] dentro de la ventana
+
+    def _lock_for(self, user_id):
+        return self._locks[hash(user_id) % len(self._locks)]
+
+    def add(self, user_id, joke_id, rating, timestamp):
+        """Agregar una clasificación; devuelve cuántas quedan guardadas para el usuario"""
+        with self._lock_for(user_id):
+            ratings = self._users.get(user_id, ()) + ((joke_id, rating, timestamp),)
+            evicted = ratings[:-self.maxlen]
+            ratings = ratings[-self.maxlen:]
+            self._users[user_id] = ratings
+            self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+            with self._stats_lock:
+                self._count(joke_id, rating, +1)
+                for old_joke_id, old_rating, _ in evicted:
+                    self._count(old_joke_id, old_rating, -1)
+                self._mark_recent()
+        return len(ratings)
+
+    def _count(self, joke_id, rating, delta):
+        """Actualizar los agregados por una clasificación guardada (+1) o desalojada (-1)"""
+        self._total_ratings += delta
+        count = self._joke_counts.get(joke_id, 0) + delta
+        if count:
+            self._joke_counts[joke_id] = count
+        else:
+            self._joke_counts.pop(joke_id, None)
+        self._histogram[self._bucket(rating)] += delta
+
+    @staticmethod
+    def _bucket(rating):
+        return min(10, max(0, int(math.floor(rating))))
+
+    def _mark_recent(self):
+        now = int(time.monotonic())
+        if self._recent and self._recent[-1][0] == now:
+            self._recent[-1] = (now, self._recent[-1][1] + 1)
+        else:
+            self._recent.append((now, 1))
+        self._prune_recent(now)
+
+    def _prune_recent(self, now):
+        while self._recent and self._recent[0][0] <= now - RATE_WINDOW_SECONDS:
+            self._recent.popleft()
+
+    def get(self, user_id):
+        """Tupla de clasificaciones del usuario (vacía si no tiene)"""
+        return self._users.get(user_id, ())
+
+    def user_version(self, user_id):
+        """Número de secuencia de escrituras del usuario (0 si nunca clasificó)"""
+        return self._user_versions.get(user_id, 0)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def stats(self, detail=False):
+        """Agregados mantenidos incrementalmente; ``detail`` agrega conteos por chiste e histograma"""
+        with self._stats_lock:
+            self._prune_recent(int(time.monotonic()))
+            result = {
+                "total_users": len(self._users),
+                "total_ratings": self._total_ratings,
+                "ratings_last_minute": sum(count for _, count in self._recent),
+            }
+            if detail:
+                result["ratings_per_joke"] = dict(self._joke_counts)
+                result["rating_histogram"] = {str(b): n for b, n in enumerate(self._histogram)}
+        return result
+
+    def load(self, data):
+        """Cargar {user_id: [(joke_id, rating, timestamp), ...]} (reemplaza a esos usuarios)"""
+        for user_id, ratings in data.items():
+            ratings = tuple(ratings)[-self.maxlen:]
+            with self._lock_for(user_id):
+                previous = self._users.get(user_id, ())
+                self._users[user_id] = ratings
+                self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+                with self._stats_lock:
+                    for joke_id, rating, _ in previous:
+                        self._count(joke_id, rating, -1)
+                    for joke_id, rating, _ in ratings:
+                        self._count(joke_id, rating, +1)
+
+
+def parse_rating(data):
+    """Validar una clasificación con las reglas de /rate/joke; devuelve (user_id, joke_id, rating)"""
+    try:
+        user_id = int(data.get("user_id"))
+        joke_id = int(data.get("joke_id"))
+        rating = float(data.get("rating"))
+    except (AttributeError, ValueError, TypeError):
+        raise ValueError("Datos inválidos. Se requiere user_id (int), joke_id (int), rating (float)")
+    
+    # Validar rating en escala 0-10
+    if not (0 <= rating <= 10):
+        raise ValueError("Rating debe estar entre 0 y 10")
+    return user_id, joke_id, rating
+
+
+def load_snapshot(store, path):
+    """Cargar en el almacén la instantánea JSON {user_id: [{joke_id, rating, timestamp}, ...]}"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    store.load({
+        int(user_id): [(r['joke_id'], r['rating'], r['timestamp']) for r in ratings_list]
+        for user_id, ratings_list in data.items()
+    })
+
+
+def append_log(records, path):
+    """Agregar registros al historial NDJSON y forzarlos a disco"""
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def purge_log(path, user_ids):
+    """Quitar del historial NDJSON las clasificaciones de ``user_ids``; devuelve cuántas se quitaron"""
+    if not os.path.exists(path):
+        return 0
+    removed = 0
+    tmp_path = path + ".tmp"
+    with open(path, 'r') as src, open(tmp_path, 'w') as dst:
+        for line in src:
+            try:
+                if int(json.loads(line)["user_id"]) in user_ids:
+                    removed += 1
+                    continue
+            except (ValueError, KeyError, TypeError):
+                pass  # Conservar las líneas que no se pueden leer
+            dst.write(line)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, path)
+    return removed
@@ -0,0 +1,191 @@
+"""Reproducir una traza de peticiones contra una instancia local de la API.
+
+La traza la escribe ``jokes_api.py`` con ``REQUEST_TRACE_FILE`` activado
+(ver ``request_trace.py``). Las peticiones se envían respetando los
+intervalos originales, multiplicados por ``--speed`` (2 = el doble de
+rápido, 0 = sin esperas), desde un grupo de hilos para que una respuesta
+lenta no frene a las siguientes. Así se reproduce la mezcla real de
+tráfico, por ejemplo las ráfagas de ``/``, ``/predict/jokes``, ``/stats``
+y ``/user/ratings`` que dispara cada rerun de Streamlit.
+
+Cada usuario anonimizado se reemplaza por un id numérico estable, así que
+las peticiones de un mismo usuario siguen apuntando al mismo usuario. El
+cliente anonimizado se envía como ``X-Client-Id``, para que el control de
+admisión reparta los límites entre los clientes originales en lugar de
+tratar toda la reproducción como un único cliente (la API solo lo tiene
+en cuenta si la máquina que reproduce está en su ``TRUSTED_PROXIES``).
+
+Uso:
+    python replay_trace.py trace.ndjson.1 trace.ndjson [--base-url http://127.0.0.1:5017]
+                           [--speed 2] [--workers 32] [--output reporte.json]
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = "http://127.0.0.1:5017"
+# Los usuarios reproducidos se ubican desde este id para no mezclarse con los reales
+REPLAY_USER_BASE = 10 ** 9
+# Peticiones POST que se pueden reproducir (la carga masiva no guarda su cuerpo)
+REPLAYABLE_POSTS = ("/rate/joke",)
+
+_local = threading.local()
+
+
+def load_trace(paths):
+    """Peticiones de uno o más archivos de traza, ordenadas por hora"""
+    entries = []
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+    entries.sort(key=lambda e: e["ts"])
+    return entries
+
+
+def replay_user_id(token):
+    """Id numérico estable para un usuario anonimizado"""
+    return REPLAY_USER_BASE + int(token[:8], 16)
+
+
+def to_request(entry):
+    """(método, ruta, parámetros, cuerpo, cliente) de una entrada, o None si no se puede reproducir"""
+    method = entry["method"]
+    if method == "POST" and entry["path"] not in REPLAYABLE_POSTS:
+        return None
+    if method not in ("GET", "POST"):
+        return None
+    params = dict(entry.get("params", {}))
+    if "user_id" in params:
+        params["user_id"] = replay_user_id(params["user_id"])
+    body = None
+    if "body" in entry:
+        body = dict(entry["body"])
+        if "user_id" in body:
+            body["user_id"] = replay_user_id(body["user_id"])
+    return method, entry["path"], params, body, entry.get("client")
+
+
+def _session():
+    # Una sesión (y su conexión keep-alive) por hilo
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def send(base_url, req, timeout):
+    """Enviar una petición; devuelve (latencia en ms, código de estado o None si falló)"""
+    method, path, params, body, client = req
+    headers = {"X-Client-Id": f"replay-{client}"} if client else None
+    start = time.perf_counter()
+    try:
+        response = _session().request(method, base_url + path, params=params, json=body,
+                                      headers=headers, timeout=timeout)
+        response.content  # Leer el cuerpo completo (incluye respuestas en streaming)
+        status = response.status_code
+    except requests.RequestException:
+        status = None
+    return (time.perf_counter() - start) * 1000, status
+
+
+def percentile(sorted_values, q):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return round(sorted_values[index], 3)
+
+
+def summarize(results):
+    """Conteos, errores y percentiles de latencia de una lista de (latencia, estado)"""
+    latencies = sorted(latency for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        key = str(status) if status is not None else "connection_error"
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, status in results if status is None or status >= 500),
+        "client_errors": sum(1 for _, status in results if status is not None and 400 <= status < 500),
+        "status_counts": statuses,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+    }
+
+
+def replay(entries, base_url=BASE_URL, speed=1.0, workers=32, timeout=30):
+    """Reproducir las entradas al ritmo original (dividido por ``speed``) y medir las respuestas"""
+    requests_to_send = [(entry, to_request(entry)) for entry in entries]
+    skipped = sum(1 for _, req in requests_to_send if req is None)
+    requests_to_send = [(entry, req) for entry, req in requests_to_send if req is not None]
+
+    first_ts = requests_to_send[0][0]["ts"] if requests_to_send else 0.0
+    futures = []
+    max_lag = 0.0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for entry, req in requests_to_send:
+            if speed > 0:
+                due = start + (entry["ts"] - first_ts) / speed
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    max_lag = max(max_lag, -wait)
+            futures.append((req[1], pool.submit(send, base_url, req, timeout)))
+        results = [(path, future.result()) for path, future in futures]
+    elapsed = time.perf_counter() - start
+
+    by_path = {}
+    for path, result in results:
+        by_path.setdefault(path, []).append(result)
+
+    trace_span = requests_to_send[-1][0]["ts"] - requests_to_send[0][0]["ts"] if requests_to_send else 0.0
+    report = {
+        "base_url": base_url,
+        "speed": speed,
+        "skipped": skipped,
+        "trace_seconds": round(trace_span, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(results) / elapsed, 1) if elapsed else None,
+        # Cuánto se atrasó el envío respecto del ritmo pedido (si crece, faltan hilos)
+        "max_send_lag_ms": round(max_lag * 1000, 3),
+    }
+    report.update(summarize([result for _, result in results]))
+    report["endpoints"] = {path: summarize(path_results) for path, path_results in sorted(by_path.items())}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducir una traza de peticiones contra la API")
+    parser.add_argument("traces", nargs="+", help="Archivos de traza NDJSON (se ordenan por hora)")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--speed", type=float, default=1.0, help="Multiplicador del ritmo original (0 = sin esperas)")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", default=None, help="Guardar el reporte en JSON")
+    args = parser.parse_args()
+
+    entries = load_trace(args.traces)
+    print(f"▶️ Reproduciendo {len(entries)} peticiones contra {args.base_url} (x{args.speed})")
+    report = replay(entries, args.base_url, speed=args.speed, workers=args.workers, timeout=args.timeout)
+
+    for key, value in report.items():
+        if key != "endpoints":
+            print(f"   {key}: {value}")
+    for path, stats in report["endpoints"].items():
+        print(f"   {path}: {stats['requests']} peticiones, p50 {stats['p50_ms']} ms, "
+              f"p99 {stats['p99_ms']} ms, {stats['errors']} errores")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Reporte guardado en {args.output}")
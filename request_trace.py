@@ -0,0 +1,84 @@
+"""Registro anonimizado de las peticiones a la API, para reproducirlas con ``replay_trace.py``.
+
+Cada petición se guarda como una línea NDJSON con la hora de llegada, el
+cliente, el método, la ruta, los parámetros, el estado y la latencia. El
+``user_id`` y el cliente se reemplazan por un hash con sal (el mismo
+usuario siempre da el mismo hash dentro de una traza, pero no se puede
+recuperar el id original) y de los cuerpos
+solo se guardan los campos de ``/rate/joke``. El archivo rota al llegar a
+``max_bytes`` y se conservan ``backups`` archivos anteriores.
+"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+# Campos del cuerpo de /rate/joke que se conservan (además del usuario anonimizado)
+BODY_FIELDS = ("joke_id", "rating")
+
+
+def anonymize(user_id, salt):
+    """Hash corto y estable de un user_id"""
+    return hmac.new(salt, str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+class TraceRecorder:
+    """Escritor NDJSON con rotación por tamaño, seguro entre hilos"""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backups=5, salt=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        # Sin sal fija, cada arranque usa una nueva y las trazas no se pueden cruzar
+        self.salt = salt.encode() if salt else os.urandom(16)
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+        self.recorded = 0
+
+    def _rotate(self):
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a")
+
+    def record(self, method, path, params, body, status, latency_ms, ts=None, client=None):
+        """Agregar una petición a la traza, anonimizando el user_id y el cliente.
+
+        ``ts`` es la hora de llegada (si no, la actual) y ``client`` el id de
+        cliente o la dirección que usa el control de admisión.
+        """
+        params = dict(params)
+        if "user_id" in params:
+            params["user_id"] = anonymize(params["user_id"], self.salt)
+        entry = {
+            "ts": round(ts if ts is not None else time.time(), 6),
+            "method": method,
+            "path": path,
+            "params": params,
+            "status": status,
+            "latency_ms": round(latency_ms, 3),
+        }
+        if client is not None:
+            entry["client"] = anonymize(client, self.salt)
+        if isinstance(body, dict):
+            entry["body"] = {field: body[field] for field in BODY_FIELDS if field in body}
+            if "user_id" in body:
+                entry["body"]["user_id"] = anonymize(body["user_id"], self.salt)
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self._file.tell() + len(line) > self.max_bytes and self._file.tell() > 0:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
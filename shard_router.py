@@ -0,0 +1,390 @@
+"""Router para correr la API en varias instancias (shards), cada una dueña de parte de los usuarios.
+
+Cada usuario pertenece a un shard según un anillo de hashing consistente
+sobre su ``user_id``, así que todo su estado (clasificaciones, sesgo,
+cachés) vive en una sola instancia. El router reenvía ``/rate/joke``,
+``/predict/jokes``, ``/recommend/jokes`` y ``/user/ratings`` al shard
+dueño y suma las estadísticas de todos en ``/stats``.
+
+Al agregar un shard (``POST /admin/shards``) solo cambian de dueño los
+usuarios que le tocan en el anillo nuevo: se pausan las escrituras, se
+copian al nuevo sus clasificaciones vigentes (``/admin/users``, la base de
+usuarios de cada shard) y su historial (``/admin/log``), se cambia el
+anillo y se borran de su shard anterior. La lista de shards se guarda en
+``SHARDS_FILE``.
+
+Los endpoints ``/admin`` del router y de los shards exigen la misma
+``SHARD_ADMIN_TOKEN`` en el encabezado ``X-Admin-Token``; sin ella
+configurada responden 403, así que no se puede rebalancear.
+
+En una sola máquina:
+    export SHARD_ADMIN_TOKEN=una-clave-larga
+    DATA_DIR=shard0 API_PORT=5101 python jokes_api.py
+    DATA_DIR=shard1 API_PORT=5102 python jokes_api.py
+    python shard_router.py --shards http://127.0.0.1:5101,http://127.0.0.1:5102
+    DATA_DIR=shard2 API_PORT=5103 python jokes_api.py
+    curl -X POST http://127.0.0.1:5017/admin/shards -H "Content-Type: application/json" \\
+         -H "X-Admin-Token: $SHARD_ADMIN_TOKEN" -d '{"url": "http://127.0.0.1:5103"}'
+En varios nodos, cada instancia usa ``API_HOST=0.0.0.0`` y ``TRUSTED_PROXIES`` con la
+dirección del router, para que sus límites por cliente vean al cliente
+original y no al router.
+"""
+import argparse
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask, Response, jsonify, request
+
+app = Flask("jokes_shard_router")
+
+ROUTER_HOST = os.environ.get("ROUTER_HOST", "127.0.0.1")
+ROUTER_PORT = int(os.environ.get("ROUTER_PORT", 5017))
+SHARDS_FILE = os.environ.get("SHARDS_FILE", "shards.json")
+SHARD_ADMIN_TOKEN = os.environ.get("SHARD_ADMIN_TOKEN", "")
+SHARD_TIMEOUT = float(os.environ.get("SHARD_TIMEOUT", 10))
+STATS_MAX_AGE = int(os.environ.get("STATS_MAX_AGE", 5))
+# Proxies delante del router (p. ej. Streamlit) cuyo X-Client-Id se reenvía a los shards
+TRUSTED_PROXIES = {a.strip() for a in os.environ.get("TRUSTED_PROXIES", "").split(",") if a.strip()}
+# Puntos por shard en el anillo: más puntos, reparto más parejo
+VIRTUAL_NODES = 64
+# Usuarios o registros del historial por envío al shard nuevo durante un rebalanceo
+MIGRATION_BATCH = 5000
+
+# Encabezados de la respuesta del shard que se devuelven al cliente
+FORWARD_HEADERS = ("Content-Type", "ETag", "Cache-Control", "Retry-After", "Content-Disposition")
+# Estadísticas que se suman entre shards
+SUMMED_STATS = ("total_users_with_ratings", "total_ratings_stored", "ratings_last_minute")
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales"""
+
+    def __init__(self, shards, vnodes=VIRTUAL_NODES):
+        self.shards = list(shards)
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(vnodes))
+        self._keys = [key for key, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def owner(self, user_id):
+        """Shard dueño de un usuario"""
+        index = bisect.bisect(self._keys, _hash(str(int(user_id)))) % len(self._keys)
+        return self._owners[index]
+
+
+ring = None
+# Solo un rebalanceo a la vez; mientras dura, las escrituras se rechazan con 503
+rebalance_lock = threading.Lock()
+writes_paused = threading.Event()
+# Escrituras ya admitidas que se están reenviando; el rebalanceo espera a que terminen
+writes_cond = threading.Condition()
+writes_in_flight = 0
+_local = threading.local()
+
+
+def _session():
+    # Una sesión (y su conexión keep-alive) por hilo
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def admin_allowed():
+    """La petición trae la clave de administración (nunca, si no hay una configurada)"""
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(SHARD_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), SHARD_ADMIN_TOKEN.encode())
+
+
+def _admin_headers():
+    return {"X-Admin-Token": SHARD_ADMIN_TOKEN} if SHARD_ADMIN_TOKEN else {}
+
+
+def load_shards(path, default):
+    """Lista de shards guardada (refleja los rebalanceos) o la pasada al iniciar"""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)["shards"]
+    return default
+
+
+def save_shards(path, shards):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"shards": shards}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def forward(shard):
+    """Reenviar la petición actual a un shard y devolver su respuesta tal cual"""
+    headers = {}
+    for name in ("Content-Type", "If-None-Match"):
+        if name in request.headers:
+            headers[name] = request.headers[name]
+    if "X-Client-Id" in request.headers and request.remote_addr in TRUSTED_PROXIES:
+        headers["X-Client-Id"] = request.headers["X-Client-Id"]
+    # Para que los límites por cliente de cada shard vean al cliente y no al router.
+    # Se agrega la dirección de la conexión: la cadena recibida puede ser inventada.
+    forwarded = request.headers.get("X-Forwarded-For")
+    headers["X-Forwarded-For"] = f"{forwarded}, {request.remote_addr}" if forwarded else request.remote_addr
+    try:
+        upstream = _session().request(request.method, shard + request.path, params=request.args,
+                                      data=request.get_data(), headers=headers, timeout=SHARD_TIMEOUT)
+    except requests.RequestException:
+        return jsonify({"error": f"Shard no disponible: {shard}"}), 502
+    response = Response(upstream.content, status=upstream.status_code)
+    for name in FORWARD_HEADERS:
+        if name in upstream.headers:
+            response.headers[name] = upstream.headers[name]
+    return response
+
+
+def route_by_user(user_id):
+    """Reenviar al dueño del usuario; sin un user_id válido, cualquier shard responde el error"""
+    current = ring
+    try:
+        shard = current.owner(user_id)
+    except (TypeError, ValueError):
+        shard = current.shards[0]
+    return forward(shard)
+
+
+@app.route("/", methods=["GET"])
+def hello_world():
+    return forward(ring.shards[0])
+
+
+@app.route("/predict/jokes", methods=["GET"])
+@app.route("/recommend/jokes", methods=["GET"])
+@app.route("/user/ratings", methods=["GET"])
+def route_read():
+    return route_by_user(request.args.get("user_id"))
+
+
+@app.route("/rate/joke", methods=["POST"])
+def route_rate():
+    global writes_in_flight
+    # Comprobar la pausa y contarse bajo el mismo lock con el que se activa
+    with writes_cond:
+        if writes_paused.is_set():
+            response = jsonify({"error": "Rebalanceando shards, reintenta en unos segundos"})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        writes_in_flight += 1
+    try:
+        data = request.get_json(silent=True)
+        return route_by_user(data.get("user_id") if isinstance(data, dict) else None)
+    finally:
+        with writes_cond:
+            writes_in_flight -= 1
+            writes_cond.notify_all()
+
+
+def pause_writes():
+    """Rechazar escrituras nuevas y esperar a que terminen las que ya se estaban reenviando"""
+    with writes_cond:
+        writes_paused.set()
+        # Cada reenvío vence a los SHARD_TIMEOUT segundos
+        if not writes_cond.wait_for(lambda: writes_in_flight == 0, timeout=SHARD_TIMEOUT * 2):
+            writes_paused.clear()
+            raise RuntimeError("Las escrituras en curso no terminaron a tiempo")
+
+
+def _fetch_stats(shard, detail):
+    try:
+        response = _session().get(f"{shard}/stats", params={"detail": int(detail)}, timeout=SHARD_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def _sum_counts(dicts):
+    total = {}
+    for counts in dicts:
+        for key, value in counts.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """Estadísticas sumadas de todos los shards, más las de cada uno"""
+    detail = request.args.get("detail", "0").lower() in ("1", "true")
+    shards = ring.shards
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        per_shard = dict(zip(shards, pool.map(lambda s: _fetch_stats(s, detail), shards)))
+    available = [stats for stats in per_shard.values() if stats is not None]
+
+    response = {key: sum(stats[key] for stats in available) for key in SUMMED_STATS}
+    response.update({
+        "jokes_available": max((stats["jokes_available"] for stats in available), default=0),
+        "model_loaded": bool(available) and all(stats["model_loaded"] for stats in available),
+        "data_loaded": bool(available) and all(stats["data_loaded"] for stats in available),
+        "shards": len(shards),
+        "unavailable_shards": [shard for shard, stats in per_shard.items() if stats is None],
+        "rebalancing": writes_paused.is_set(),
+        "per_shard": per_shard,
+    })
+    if detail:
+        response["ratings_per_joke"] = _sum_counts(stats["ratings_per_joke"] for stats in available)
+        response["rating_histogram"] = _sum_counts(stats["rating_histogram"] for stats in available)
+
+    response = jsonify(response)
+    response.add_etag()
+    response.headers["Cache-Control"] = f"public, max-age={STATS_MAX_AGE}"
+    return response.make_conditional(request)
+
+
+def _stream_lines(url):
+    """Líneas NDJSON de un endpoint de administración de un shard"""
+    with _session().get(url, headers=_admin_headers(), stream=True, timeout=SHARD_TIMEOUT) as response:
+        response.raise_for_status()
+        for raw in response.iter_lines():
+            if raw:
+                yield raw.decode("utf-8")
+
+
+def _post_lines(url, lines):
+    headers = dict(_admin_headers(), **{"Content-Type": "application/x-ndjson"})
+    response = _session().post(url, data="\n".join(lines).encode(), headers=headers, timeout=None)
+    response.raise_for_status()
+    return response.json()
+
+
+def _copy(source_url, target_url, belongs, on_line=None):
+    """Copiar en lotes las líneas de ``source_url`` para las que ``belongs(registro)``; devuelve cuántas"""
+    copied = 0
+    batch = []
+    for line in _stream_lines(source_url):
+        record = json.loads(line)
+        if not belongs(record):
+            continue
+        if on_line is not None:
+            on_line(record)
+        batch.append(line)
+        if len(batch) >= MIGRATION_BATCH:
+            _post_lines(target_url, batch)
+            copied += len(batch)
+            batch = []
+    if batch:
+        _post_lines(target_url, batch)
+        copied += len(batch)
+    return copied
+
+
+def migrate(source, target, new_ring, moved_users):
+    """Copiar a ``target`` los usuarios de ``source`` que ahora le pertenecen.
+
+    Primero sus clasificaciones vigentes, leídas de la base de usuarios del
+    shard (incluye a los que nunca pasaron por el historial, como los
+    migrados de ``user_ratings.json``), y después su historial. Agrega a
+    ``moved_users`` cada usuario a medida que se envía, así un fallo a
+    mitad de camino se puede deshacer. Devuelve los registros del historial copiados.
+    """
+    def belongs(record):
+        return new_ring.owner(int(record["user_id"])) == target
+
+    _copy(f"{source}/admin/users", f"{target}/admin/users", belongs,
+          on_line=lambda record: moved_users.add(int(record["user_id"])))
+    return _copy(f"{source}/admin/log", f"{target}/admin/log", belongs)
+
+
+def _purge(shard, user_ids):
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), MIGRATION_BATCH):
+        response = _session().post(f"{shard}/admin/purge", json={"user_ids": user_ids[start:start + MIGRATION_BATCH]},
+                                   headers=_admin_headers(), timeout=None)
+        response.raise_for_status()
+
+
+def add_shard(url):
+    """Agregar un shard y mover a él los usuarios que le tocan en el anillo nuevo"""
+    global ring
+    with rebalance_lock:
+        old_ring = ring
+        if url in old_ring.shards:
+            raise ValueError(f"{url} ya es parte del anillo")
+        new_ring = HashRing(old_ring.shards + [url])
+
+        pause_writes()
+        moved = {}
+        try:
+            # Las clasificaciones aceptadas tienen que estar en el historial antes de exportarlo
+            for shard in old_ring.shards:
+                _session().post(f"{shard}/admin/flush", headers=_admin_headers(),
+                                timeout=SHARD_TIMEOUT * 4).raise_for_status()
+            report = {}
+            for shard in old_ring.shards:
+                moved[shard] = set()
+                moved_ratings = migrate(shard, url, new_ring, moved[shard])
+                report[shard] = {"moved_users": len(moved[shard]), "moved_ratings": moved_ratings}
+        except Exception:
+            # Deshacer la copia parcial; el anillo anterior sigue vigente
+            try:
+                _purge(url, set().union(*moved.values()))
+            finally:
+                writes_paused.clear()
+            raise
+
+        # Desde acá las lecturas van al shard nuevo; después se borran los originales
+        ring = new_ring
+        save_shards(SHARDS_FILE, new_ring.shards)
+        try:
+            for shard, user_ids in moved.items():
+                _purge(shard, user_ids)
+        finally:
+            writes_paused.clear()
+        return report
+
+
+@app.route("/admin/shards", methods=["GET"])
+def list_shards():
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    return jsonify({"shards": ring.shards, "rebalancing": writes_paused.is_set()})
+
+
+@app.route("/admin/shards", methods=["POST"])
+def post_shard():
+    """Agregar un shard y rebalancear (bloquea hasta terminar)"""
+    if not admin_allowed():
+        return jsonify({"error": "No autorizado"}), 403
+    data = request.get_json(silent=True) or {}
+    url = str(data.get("url", "")).rstrip("/")
+    if not url:
+        return jsonify({"error": "Se requiere url"}), 400
+    try:
+        report = add_shard(url)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Rebalanceo fallido: {e}"}), 502
+    return jsonify({"shards": ring.shards, "moved": report})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Router de la API de chistes repartida en shards")
+    parser.add_argument("--shards", default=os.environ.get("SHARD_URLS", ""),
+                        help="URLs de los shards separadas por comas (si no existe SHARDS_FILE)")
+    parser.add_argument("--host", default=ROUTER_HOST)
+    parser.add_argument("--port", type=int, default=ROUTER_PORT)
+    args = parser.parse_args()
+
+    shards = load_shards(SHARDS_FILE, [s.strip().rstrip("/") for s in args.shards.split(",") if s.strip()])
+    if not shards:
+        raise SystemExit("❌ No hay shards configurados (usar --shards o SHARD_URLS)")
+    ring = HashRing(shards)
+    save_shards(SHARDS_FILE, shards)
+
+    print(f"🔀 Router con {len(shards)} shards: {', '.join(shards)}")
+    print(f"🌐 Servidor corriendo en http://{args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
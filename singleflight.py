@@ -0,0 +1,66 @@
+"""Deduplicación de cálculos concurrentes idénticos (single-flight)"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en un solo cálculo.
+
+    La primera llamada ejecuta la función; las que llegan mientras está en
+    curso esperan y reciben el mismo resultado. Al terminar, la clave se
+    libera, así que no se guarda nada entre ráfagas (no es una caché).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.requests = 0
+        self.computations = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Ejecutar fn() una sola vez por clave en vuelo; devuelve (resultado, compartido)"""
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.computations += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        """Contadores de llamadas, cálculos realizados y cálculos ahorrados"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "computations": self.computations,
+                "computations_saved": self.coalesced,
+                "in_flight": len(self._calls),
+            }
@@ -4,6 +4,8 @@ import requests
 import json
 import random
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Configuración de la página
@@ -20,6 +22,10 @@ API_BASE_URL =  "https://chistes-api-2024.loca.lt"
 # Archivo para guardar perfiles de usuarios
 USER_PROFILES_FILE = "user_profiles.csv"
 
+# Segundos que se reutilizan el estado de la API y las estadísticas entre ejecuciones
+API_STATUS_TTL = 15
+STATS_TTL = 10
+
 @st.cache_data
 def load_jokes():
     """Cargar el dataset de chistes"""
@@ -30,6 +36,15 @@ def load_jokes():
         st.error("❌ No se encontró el archivo jokes.csv")
         return None
 
+def session_headers():
+    """Id de esta sesión para los límites por cliente de la API (cada pestaña tiene su propia cubeta).
+
+    La API solo lo tiene en cuenta si la dirección de esta app está en su ``TRUSTED_PROXIES``.
+    """
+    if "client_id" not in st.session_state:
+        st.session_state.client_id = uuid.uuid4().hex
+    return {"X-Client-Id": st.session_state.client_id}
+
 def send_rating_to_api(user_id, joke_id, rating):
     """Enviar clasificación a la API"""
     try:
@@ -39,10 +54,14 @@ def send_rating_to_api(user_id, joke_id, rating):
             "rating": float(rating)   # Convertir a float nativo de Python
         }
         
-        response = requests.post(f"{API_BASE_URL}/rate/joke", json=payload, timeout=5)
+        response = requests.post(f"{API_BASE_URL}/rate/joke", json=payload,
+                                 headers=session_headers(), timeout=5)
         
         if response.status_code == 200:
             return response.json()
+        elif response.status_code in (429, 503):
+            st.warning(f"⏳ El servidor está ocupado, intenta de nuevo en {response.headers.get('Retry-After', 'unos')} segundos")
+            return None
         else:
             st.error(f"Error enviando clasificación: {response.status_code}")
             return None
@@ -55,7 +74,7 @@ def get_user_ratings(user_id):
     """Obtener las clasificaciones del usuario"""
     try:
         response = requests.get(f"{API_BASE_URL}/user/ratings", 
-                              params={"user_id": int(user_id)}, timeout=5)  # Convertir a int
+                              params={"user_id": int(user_id)}, headers=session_headers(), timeout=5)  # Convertir a int
         
         if response.status_code == 200:
             return response.json()
@@ -66,14 +85,18 @@ def get_user_ratings(user_id):
         return {"ratings": [], "total_ratings": 0}
 
 def get_recommendation(user_id, top_n=1):
-    """Obtener recomendaciones de la API"""
+    """Obtener recomendaciones de la API (solo ids y ratings; el texto sale del catálogo local)"""
     try:
         response = requests.get(f"{API_BASE_URL}/recommend/jokes", 
-                              params={"user_id": int(user_id), "top_n": int(top_n)}, timeout=10)  # Convertir a int
+                              params={"user_id": int(user_id), "top_n": int(top_n), "compact": 1},
+                              headers=session_headers(), timeout=10)  # Convertir a int
         
         if response.status_code == 200:
             data = response.json()
             return data
+        elif response.status_code in (429, 503):
+            st.warning(f"⏳ El servidor está ocupado, intenta de nuevo en {response.headers.get('Retry-After', 'unos')} segundos")
+            return None
         else:
             st.error(f"Error obteniendo recomendación: {response.status_code}")
             return None
@@ -82,11 +105,20 @@ def get_recommendation(user_id, top_n=1):
         st.error(f"Error de conexión con la API: {e}")
         return None
 
+def get_joke_text(joke_id):
+    """Texto de un chiste desde el catálogo cargado localmente"""
+    jokes = load_jokes()
+    if jokes is None:
+        return "N/A"
+    match = jokes[jokes['joke_id'] == joke_id]
+    return match['joke_text'].iloc[0] if not match.empty else "N/A"
+
 def get_predicted_rating(user_id, joke_id):
     """Obtener la predicción de rating para un chiste específico"""
     try:
         response = requests.get(f"{API_BASE_URL}/predict/jokes", 
-                              params={"user_id": int(user_id), "joke_id": int(joke_id)}, timeout=5)
+                              params={"user_id": int(user_id), "joke_id": int(joke_id)},
+                              headers=session_headers(), timeout=5)
         
         if response.status_code == 200:
             return response.json()
@@ -96,6 +128,97 @@ def get_predicted_rating(user_id, joke_id):
     except requests.exceptions.RequestException:
         return None
 
+@st.cache_resource
+def get_prefetch_executor():
+    """Hilos compartidos para precargar la próxima recomendación en segundo plano"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+def fetch_next_recommendation(user_id, excluded_jokes, total_jokes, headers):
+    """Buscar el mejor chiste no visto y su predicción (corre fuera del hilo de Streamlit, sin st.*)"""
+    user_id = int(user_id)
+    for top_n in (10, total_jokes):
+        response = requests.get(f"{API_BASE_URL}/recommend/jokes",
+                                params={"user_id": user_id, "top_n": int(top_n), "compact": 1},
+                                headers=headers, timeout=10)
+        if response.status_code != 200:
+            return None
+        recommendation = response.json()
+        unviewed = [joke for joke in recommendation.get("recommendations", [])
+                    if joke["joke_id"] not in excluded_jokes]
+        if unviewed:
+            best_joke = unviewed[0]
+            prediction = requests.get(f"{API_BASE_URL}/predict/jokes",
+                                      params={"user_id": user_id, "joke_id": int(best_joke["joke_id"])},
+                                      headers=headers, timeout=5)
+            return {
+                "joke_id": best_joke["joke_id"],
+                "predicted_rating": best_joke["predicted_rating"],
+                "user_bias": recommendation.get("user_bias", 0),
+                "prediction": prediction.json() if prediction.status_code == 200 else None
+            }
+    return None
+
+def prefetch_key():
+    """Lo que invalida una recomendación precargada: usuario, chiste actual y nuevas calificaciones"""
+    return (st.session_state.user_id, st.session_state.current_joke_id, st.session_state.rating_version)
+
+def start_prefetch(total_jokes):
+    """Precargar la próxima recomendación mientras el usuario lee el chiste actual"""
+    prefetch = st.session_state.get("prefetch")
+    if prefetch and prefetch["key"] == prefetch_key():
+        return
+    future = get_prefetch_executor().submit(
+        fetch_next_recommendation,
+        st.session_state.user_id,
+        set(st.session_state.viewed_jokes) | {st.session_state.current_joke_id},
+        total_jokes,
+        session_headers()
+    )
+    st.session_state.prefetch = {"key": prefetch_key(), "future": future}
+
+def take_prefetched_recommendation():
+    """Usar la recomendación precargada si sigue siendo válida (None si hay que pedirla)"""
+    prefetch = st.session_state.get("prefetch")
+    st.session_state.prefetch = None
+    if not prefetch or prefetch["key"] != prefetch_key():
+        return None
+    try:
+        result = prefetch["future"].result(timeout=10)
+    except Exception:
+        return None
+    if not result or result["joke_id"] in st.session_state.viewed_jokes:
+        return None
+    if result["prediction"]:
+        # Así el próximo render no vuelve a pedir la predicción del nuevo chiste
+        key = (st.session_state.user_id, result["joke_id"], st.session_state.rating_version)
+        st.session_state.prediction_cache[key] = result["prediction"]
+    return result
+
+def invalidate_prefetch():
+    """Una nueva calificación cambia el sesgo del usuario: descartar lo precargado"""
+    st.session_state.rating_version += 1
+    st.session_state.prefetch = None
+    st.session_state.prediction_cache = {}
+
+def get_current_prediction(user_id, joke_id):
+    """Predicción del chiste actual, memorizada por (usuario, chiste, versión de calificaciones)"""
+    key = (user_id, joke_id, st.session_state.rating_version)
+    if key not in st.session_state.prediction_cache:
+        prediction = get_predicted_rating(user_id, joke_id)
+        if prediction is None:
+            return None
+        st.session_state.prediction_cache[key] = prediction
+    return st.session_state.prediction_cache[key]
+
+def get_user_history(user_id):
+    """Historial del usuario, memorizado por sesión hasta que califique otro chiste"""
+    key = (user_id, st.session_state.rating_version)
+    if st.session_state.get("user_history_key") != key:
+        st.session_state.user_history = get_user_ratings(user_id)
+        st.session_state.user_history_key = key
+    return st.session_state.user_history
+
+@st.cache_data(ttl=STATS_TTL, show_spinner=False)
 def get_system_stats():
     """Obtener estadísticas del sistema para ayudar con IDs únicos"""
     try:
@@ -118,19 +241,25 @@ def suggest_unique_id():
         # Fallback si no hay API
         return random.randint(2000, 9999)
 
+@st.cache_data(ttl=API_STATUS_TTL, show_spinner=False)
 def check_api_status():
-    """Verificar si la API está funcionando"""
+    """Verificar si la API está funcionando (se vuelve a comprobar cada pocos segundos)"""
     try:
         response = requests.get(f"{API_BASE_URL}/", timeout=3)
         return response.status_code == 200
     except:
         return False
 
+@st.cache_data(show_spinner=False)
+def read_user_profiles(modified_at):
+    """Leer el CSV de perfiles; se vuelve a leer solo si cambió su fecha de modificación"""
+    return pd.read_csv(USER_PROFILES_FILE)
+
 def load_user_profiles():
     """Cargar perfiles de usuarios desde CSV"""
     try:
         if os.path.exists(USER_PROFILES_FILE):
-            return pd.read_csv(USER_PROFILES_FILE)
+            return read_user_profiles(os.path.getmtime(USER_PROFILES_FILE))
         else:
             # Crear DataFrame vacío con las columnas necesarias
             return pd.DataFrame(columns=[
@@ -220,6 +349,109 @@ def get_profile_statistics():
         st.error(f"Error obteniendo estadísticas: {e}")
         return None
 
+@st.fragment
+def render_rating_controls(api_status):
+    """Slider y botones de acción: mover el slider solo vuelve a ejecutar este fragmento"""
+    # Sistema de calificación
+    st.subheader("⭐ Califica este chiste")
+    rating = st.slider(
+        "¿Qué tan gracioso te pareció?",
+        min_value=-10.0,
+        max_value=10.0,
+        value=5.0,
+        step=0.5,
+        help="0 = Nada gracioso, 10 = Muy gracioso"
+    )
+
+    # Botones de acción
+    col_btn1, col_btn2, col_btn3 = st.columns(3)
+
+    with col_btn1:
+        if st.button("📝 Guardar Calificación", type="primary"):
+            if api_status:
+                result = send_rating_to_api(st.session_state.user_id, st.session_state.current_joke_id, rating)
+                if result:
+                    invalidate_prefetch()
+                    st.success(f"✅ Calificación guardada: {rating}/10")
+                    st.balloons()
+                    # Recargar datos del usuario
+                    st.rerun()
+                else:
+                    st.error("❌ Error guardando la calificación")
+            else:
+                st.error("❌ API no disponible")
+
+    with col_btn2:
+        if st.button("🎲 Otro Chiste"):
+            # Seleccionar un chiste aleatorio diferente
+            available_jokes = jokes_df[jokes_df['joke_id'] != st.session_state.current_joke_id]
+            if not available_jokes.empty:
+                st.session_state.current_joke_id = available_jokes.sample(1)['joke_id'].iloc[0]
+                st.rerun()
+
+    with col_btn3:
+        if st.button("🎯 Recomendación Inteligente"):
+            if api_status:
+                # Si la próxima recomendación ya está precargada, el cambio es inmediato
+                prefetched = take_prefetched_recommendation()
+                if prefetched:
+                    st.session_state.current_joke_id = prefetched["joke_id"]
+                    st.session_state.viewed_jokes.add(prefetched["joke_id"])
+                    st.rerun()
+
+                with st.spinner("🤖 Analizando tus preferencias..."):
+                    # Obtener más recomendaciones para filtrar las ya vistas
+                    recommendation = get_recommendation(st.session_state.user_id, top_n=10)
+
+                if recommendation and recommendation.get("recommendations"):
+                    # Filtrar chistes ya vistos
+                    unviewed_jokes = [
+                        joke for joke in recommendation["recommendations"]
+                        if joke["joke_id"] not in st.session_state.viewed_jokes
+                    ]
+
+                    if unviewed_jokes:
+                        # Tomar el mejor chiste no visto
+                        best_joke = unviewed_jokes[0]
+                        st.session_state.current_joke_id = best_joke["joke_id"]
+                        st.session_state.viewed_jokes.add(best_joke["joke_id"])
+
+                        # Mostrar información de la recomendación
+                        position = len(st.session_state.viewed_jokes)
+                        st.success(f"🎯 ¡Recomendación #{position}! (Rating predicho: {best_joke['predicted_rating']:.1f})")
+
+                        # Mostrar detalles adicionales
+                        if recommendation.get("user_bias") != 0:
+                            bias_text = "optimista" if recommendation["user_bias"] > 0 else "exigente"
+                            st.info(f"📊 Basado en tu historial, eres un usuario {bias_text}")
+
+                        st.rerun()
+                    else:
+                        # Si ya vio todos los chistes recomendados
+                        if len(st.session_state.viewed_jokes) >= len(jokes_df):
+                            st.warning("🎉 ¡Has visto todos los chistes! Reiniciando historial...")
+                            st.session_state.viewed_jokes = set()
+                            st.session_state.current_joke_id = jokes_df.sample(1)['joke_id'].iloc[0]
+                            st.rerun()
+                        else:
+                            st.info("🔄 Obteniendo más recomendaciones...")
+                            # Obtener todas las recomendaciones disponibles
+                            all_recommendations = get_recommendation(st.session_state.user_id, top_n=len(jokes_df))
+                            if all_recommendations:
+                                all_unviewed = [
+                                    joke for joke in all_recommendations["recommendations"]
+                                    if joke["joke_id"] not in st.session_state.viewed_jokes
+                                ]
+                                if all_unviewed:
+                                    best_joke = all_unviewed[0]
+                                    st.session_state.current_joke_id = best_joke["joke_id"]
+                                    st.session_state.viewed_jokes.add(best_joke["joke_id"])
+                                    st.rerun()
+                else:
+                    st.error("❌ No se pudo obtener recomendación")
+            else:
+                st.error("❌ API no disponible para recomendaciones")
+
 # Cargar datos
 jokes_df = load_jokes()
 
@@ -259,6 +491,12 @@ if jokes_df is not None:
     if 'viewed_jokes' not in st.session_state:
         st.session_state.viewed_jokes = set()
     
+    # Precarga de la próxima recomendación
+    if 'rating_version' not in st.session_state:
+        st.session_state.rating_version = 0
+    if 'prediction_cache' not in st.session_state:
+        st.session_state.prediction_cache = {}
+    
     # Agregar chiste actual al historial si no está
     if st.session_state.current_joke_id not in st.session_state.viewed_jokes:
         st.session_state.viewed_jokes.add(st.session_state.current_joke_id)
@@ -533,7 +771,9 @@ if jokes_df is not None:
             # Obtener predicción si la API está disponible
             predicted_data = None
             if api_status:
-                predicted_data = get_predicted_rating(st.session_state.user_id, st.session_state.current_joke_id)
+                predicted_data = get_current_prediction(st.session_state.user_id, st.session_state.current_joke_id)
+                # Mientras se lee este chiste, buscar el siguiente en segundo plano
+                start_prefetch(len(jokes_df))
             
             # Mostrar el texto del chiste en una caja destacada
             st.markdown(f"""
@@ -586,97 +826,8 @@ if jokes_df is not None:
             else:
                 st.warning("❌ Predicción no disponible - API desconectada")
             
-            # Sistema de calificación
-            st.subheader("⭐ Califica este chiste")
-            rating = st.slider(
-                "¿Qué tan gracioso te pareció?",
-                min_value=-10.0,
-                max_value=10.0,
-                value=5.0,
-                step=0.5,
-                help="0 = Nada gracioso, 10 = Muy gracioso"
-            )
-            
-            # Botones de acción
-            col_btn1, col_btn2, col_btn3 = st.columns(3)
-            
-            with col_btn1:
-                if st.button("📝 Guardar Calificación", type="primary"):
-                    if api_status:
-                        result = send_rating_to_api(st.session_state.user_id, st.session_state.current_joke_id, rating)
-                        if result:
-                            st.success(f"✅ Calificación guardada: {rating}/10")
-                            st.balloons()
-                            # Recargar datos del usuario
-                            st.rerun()
-                        else:
-                            st.error("❌ Error guardando la calificación")
-                    else:
-                        st.error("❌ API no disponible")
-            
-            with col_btn2:
-                if st.button("🎲 Otro Chiste"):
-                    # Seleccionar un chiste aleatorio diferente
-                    available_jokes = jokes_df[jokes_df['joke_id'] != st.session_state.current_joke_id]
-                    if not available_jokes.empty:
-                        st.session_state.current_joke_id = available_jokes.sample(1)['joke_id'].iloc[0]
-                        st.rerun()
-            
-            with col_btn3:
-                if st.button("🎯 Recomendación Inteligente"):
-                    if api_status:
-                        with st.spinner("🤖 Analizando tus preferencias..."):
-                            # Obtener más recomendaciones para filtrar las ya vistas
-                            recommendation = get_recommendation(st.session_state.user_id, top_n=10)
-                            
-                        if recommendation and recommendation.get("recommendations"):
-                            # Filtrar chistes ya vistos
-                            unviewed_jokes = [
-                                joke for joke in recommendation["recommendations"]
-                                if joke["joke_id"] not in st.session_state.viewed_jokes
-                            ]
-                            
-                            if unviewed_jokes:
-                                # Tomar el mejor chiste no visto
-                                best_joke = unviewed_jokes[0]
-                                st.session_state.current_joke_id = best_joke["joke_id"]
-                                st.session_state.viewed_jokes.add(best_joke["joke_id"])
-                                
-                                # Mostrar información de la recomendación
-                                position = len(st.session_state.viewed_jokes)
-                                st.success(f"🎯 ¡Recomendación #{position}! (Rating predicho: {best_joke['predicted_rating']:.1f})")
-                                
-                                # Mostrar detalles adicionales
-                                if recommendation.get("user_bias") != 0:
-                                    bias_text = "optimista" if recommendation["user_bias"] > 0 else "exigente"
-                                    st.info(f"📊 Basado en tu historial, eres un usuario {bias_text}")
-                                
-                                st.rerun()
-                            else:
-                                # Si ya vio todos los chistes recomendados
-                                if len(st.session_state.viewed_jokes) >= len(jokes_df):
-                                    st.warning("🎉 ¡Has visto todos los chistes! Reiniciando historial...")
-                                    st.session_state.viewed_jokes = set()
-                                    st.session_state.current_joke_id = jokes_df.sample(1)['joke_id'].iloc[0]
-                                    st.rerun()
-                                else:
-                                    st.info("🔄 Obteniendo más recomendaciones...")
-                                    # Obtener todas las recomendaciones disponibles
-                                    all_recommendations = get_recommendation(st.session_state.user_id, top_n=len(jokes_df))
-                                    if all_recommendations:
-                                        all_unviewed = [
-                                            joke for joke in all_recommendations["recommendations"]
-                                            if joke["joke_id"] not in st.session_state.viewed_jokes
-                                        ]
-                                        if all_unviewed:
-                                            best_joke = all_unviewed[0]
-                                            st.session_state.current_joke_id = best_joke["joke_id"]
-                                            st.session_state.viewed_jokes.add(best_joke["joke_id"])
-                                            st.rerun()
-                        else:
-                            st.error("❌ No se pudo obtener recomendación")
-                    else:
-                        st.error("❌ API no disponible para recomendaciones")
+            # Calificación y acciones en un fragmento propio
+            render_rating_controls(api_status)
     
     with col2:
         st.header("🎯 Mejores Recomendaciones")
@@ -690,7 +841,7 @@ if jokes_df is not None:
                 
                 for i, joke in enumerate(recommendations["recommendations"], 1):
                     with st.expander(f"#{i} - Rating: {joke['predicted_rating']:.1f}/10"):
-                        st.write(joke["joke_text"])
+                        st.write(get_joke_text(joke["joke_id"]))
                         if st.button(f"Ver este chiste", key=f"view_{joke['joke_id']}"):
                             st.session_state.current_joke_id = joke["joke_id"]
                             st.rerun()
@@ -706,24 +857,19 @@ if jokes_df is not None:
         
         # Estadísticas generales
         if api_status:
-            try:
-                stats_response = requests.get(f"{API_BASE_URL}/stats", timeout=3)
-                if stats_response.status_code == 200:
-                    stats = stats_response.json()
-                    
-                    st.subheader("📈 Estadísticas del Sistema")
-                    st.metric("Usuarios Activos", stats.get("total_users_with_ratings", 0))
-                    st.metric("Total Calificaciones", stats.get("total_ratings_stored", 0))
-                    st.metric("Chistes Disponibles", stats.get("jokes_available", 0))
-            except:
-                pass
+            stats = get_system_stats()
+            if stats:
+                st.subheader("📈 Estadísticas del Sistema")
+                st.metric("Usuarios Activos", stats.get("total_users_with_ratings", 0))
+                st.metric("Total Calificaciones", stats.get("total_ratings_stored", 0))
+                st.metric("Chistes Disponibles", stats.get("jokes_available", 0))
         
         # Mostrar perfil del usuario actual
        
             
             # Mostrar estadísticas de calificaciones si la API está disponible
             if api_status:
-                user_data = get_user_ratings(st.session_state.user_id)
+                user_data = get_user_history(st.session_state.user_id)
                 if user_data.get("total_ratings", 0) > 0:
                     st.subheader("📊 Tu Historial de Calificaciones")
                     
@@ -0,0 +1,58 @@
+"""Puntuación vectorizada y factores cuantizados contra la predicción de referencia del modelo"""
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluate_model import PRECISION_TOLERANCES, compare_precision
+from scoring import FactorScorer, MatrixFactorizationModel
+
+N_USERS = 300
+N_JOKES = 120
+N_FACTORS = 20
+
+
+@pytest.fixture(scope="module")
+def model():
+    """Modelo sintético con la escala de la API; 5 chistes del catálogo quedan fuera del modelo"""
+    rng = np.random.default_rng(7)
+    return MatrixFactorizationModel(
+        global_mean=1.5,
+        user_ids=list(range(1, N_USERS + 1)),
+        joke_ids=list(range(1, N_JOKES - 4)),
+        bu=rng.normal(0, 1.5, N_USERS),
+        bi=rng.normal(0, 2.0, N_JOKES - 5),
+        pu=rng.normal(0, 0.6, (N_USERS, N_FACTORS)),
+        qi=rng.normal(0, 0.6, (N_JOKES - 5, N_FACTORS)),
+    )
+
+
+@pytest.fixture(scope="module")
+def model_files(model, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("modelo")
+    model_path = directory / "model.pkl"
+    jokes_path = directory / "jokes.csv"
+    with open(model_path, "wb") as f:
+        pickle.dump(model, f)
+    pd.DataFrame({"joke_id": range(1, N_JOKES + 1), "joke_text": "chiste"}).to_csv(jokes_path, index=False)
+    return str(model_path), str(jokes_path)
+
+
+def test_float64_matches_model_predict(model):
+    joke_ids = list(range(1, N_JOKES + 1))
+    scorer = FactorScorer(model, joke_ids)
+    for user_id in (1, 150, N_USERS, 10 ** 6):  # El último no está en el modelo
+        expected = [model.predict(user_id, joke_id).est for joke_id in joke_ids]
+        np.testing.assert_allclose(scorer.score_user(user_id), expected, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("precision", sorted(PRECISION_TOLERANCES))
+def test_quantized_within_tolerance(model_files, precision):
+    model_path, jokes_path = model_files
+    report = compare_precision(precision, model_path, jokes_path, k=10)
+    max_rmse, min_overlap = PRECISION_TOLERANCES[precision]
+    assert report["rmse_vs_float64"] <= max_rmse
+    assert report["top10_overlap"] >= min_overlap
+    assert report["within_tolerance"]
+    assert report[f"item_factor_bytes_{precision}"] < report["item_factor_bytes_float64"]
@@ -0,0 +1,394 @@
+"""Almacén de clasificaciones en dos niveles: usuarios activos en memoria, el resto en disco.
+
+Los usuarios leídos o escritos recientemente viven en un conjunto acotado
+en memoria (LRU); al superar el límite se desalojan los menos recientes,
+escribiendo antes a disco los que tengan cambios pendientes. Los demás
+quedan en una base SQLite indexada por ``user_id`` y se cargan de forma
+transparente la primera vez que se los consulta.
+
+Los agregados globales (usuarios, clasificaciones, conteos por chiste e
+histograma) se guardan en la misma base en cada escritura, así que al
+arrancar se leen en lugar de recorrer a todos los usuarios: el tiempo de
+inicio y la memoria dependen de los usuarios activos, no de todos los que
+alguna vez clasificaron.
+"""
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from rating_store import RatingStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    ratings TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS joke_counts (joke_id INTEGER PRIMARY KEY, count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS histogram (bucket INTEGER PRIMARY KEY, count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+class ColdStore:
+    """Clasificaciones de todos los usuarios en SQLite, con sus agregados al día"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # El historial NDJSON (con fsync) es el registro durable; aquí alcanza con WAL
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def read(self, user_id):
+        """``(version, tupla de clasificaciones)`` del usuario, o None si no existe"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, ratings FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], tuple(tuple(r) for r in json.loads(row[1]))
+
+    def write(self, rows):
+        """Guardar ``{user_id: (version, tupla)}`` en una transacción.
+
+        Se ignoran las filas con una versión que no sea más nueva que la
+        guardada, así un desalojo y un volcado concurrentes no se pisan.
+        """
+        joke_deltas = {}
+        bucket_deltas = {}
+        new_users = 0
+        rating_delta = 0
+
+        def count(ratings, delta):
+            for joke_id, rating, _ in ratings:
+                joke_deltas[joke_id] = joke_deltas.get(joke_id, 0) + delta
+                bucket = RatingStore._bucket(rating)
+                bucket_deltas[bucket] = bucket_deltas.get(bucket, 0) + delta
+            return delta * len(ratings)
+
+        with self._lock, self._conn:
+            for user_id, (version, ratings) in rows.items():
+                row = self._conn.execute(
+                    "SELECT version, ratings FROM users WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if row is not None and row[0] >= version:
+                    continue
+                if row is None:
+                    new_users += 1
+                else:
+                    rating_delta += count(json.loads(row[1]), -1)
+                rating_delta += count(ratings, +1)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO users (user_id, version, ratings) VALUES (?, ?, ?)",
+                    (user_id, version, json.dumps([list(r) for r in ratings]))
+                )
+            self._add_counts("joke_counts", "joke_id", "count", joke_deltas)
+            self._add_counts("histogram", "bucket", "count", bucket_deltas)
+            self._add_counts("totals", "name", "value", {"users": new_users, "ratings": rating_delta})
+
+    def delete(self, user_ids):
+        """Borrar usuarios y descontarlos de los agregados; devuelve cuántos existían"""
+        joke_deltas = {}
+        bucket_deltas = {}
+        deleted = 0
+        rating_delta = 0
+        with self._lock, self._conn:
+            for user_id in user_ids:
+                row = self._conn.execute("SELECT ratings FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                if row is None:
+                    continue
+                for joke_id, rating, _ in json.loads(row[0]):
+                    joke_deltas[joke_id] = joke_deltas.get(joke_id, 0) - 1
+                    bucket = RatingStore._bucket(rating)
+                    bucket_deltas[bucket] = bucket_deltas.get(bucket, 0) - 1
+                    rating_delta -= 1
+                self._conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+                deleted += 1
+            self._add_counts("joke_counts", "joke_id", "count", joke_deltas)
+            self._add_counts("histogram", "bucket", "count", bucket_deltas)
+            self._add_counts("totals", "name", "value", {"users": -deleted, "ratings": rating_delta})
+        return deleted
+
+    def iter_users(self, page_size=1000):
+        """``(user_id, versión, tupla de clasificaciones)`` de todos los usuarios, por páginas en orden de id"""
+        last = None
+        while True:
+            with self._lock:
+                if last is None:
+                    rows = self._conn.execute(
+                        "SELECT user_id, version, ratings FROM users ORDER BY user_id LIMIT ?", (page_size,)
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT user_id, version, ratings FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                        (last, page_size)
+                    ).fetchall()
+            for user_id, version, ratings in rows:
+                yield user_id, version, tuple(tuple(r) for r in json.loads(ratings))
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    def _add_counts(self, table, key, column, deltas):
+        self._conn.executemany(
+            f"INSERT INTO {table} ({key}, {column}) VALUES (?, ?) "
+            f"ON CONFLICT({key}) DO UPDATE SET {column} = {column} + excluded.{column}",
+            [(k, d) for k, d in deltas.items() if d]
+        )
+
+    def aggregates(self):
+        """(usuarios, clasificaciones, {joke_id: conteo}, histograma de 11 franjas)"""
+        with self._lock:
+            totals = dict(self._conn.execute("SELECT name, value FROM totals"))
+            joke_counts = {j: c for j, c in self._conn.execute("SELECT joke_id, count FROM joke_counts") if c}
+            histogram = [0] * 11
+            for bucket, n in self._conn.execute("SELECT bucket, count FROM histogram"):
+                histogram[bucket] = n
+        return totals.get("users", 0), totals.get("ratings", 0), joke_counts, histogram
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TieredRatingStore(RatingStore):
+    """``RatingStore`` con a lo sumo ``max_hot_users`` usuarios en memoria.
+
+    Misma interfaz que ``RatingStore``: ``get``, ``add`` y ``user_version``
+    cargan desde disco al usuario que no esté en memoria. Los cambios se
+    escriben a disco con ``flush()`` (la API lo llama en cada lote de
+    escritura) o al desalojar al usuario.
+
+    También se recuerdan (hasta ``max_hot_users``) los usuarios que no
+    están en disco, para que las consultas repetidas de quien nunca
+    clasificó (ETag, sesgo y predicción de cada ``/predict``) no vayan a
+    SQLite cada vez. Se olvidan en cuanto el usuario clasifica.
+    """
+
+    def __init__(self, path, max_hot_users=100000, maxlen=3, stripes=64):
+        super().__init__(maxlen=maxlen, stripes=stripes)
+        self.max_hot_users = max_hot_users
+        self._users = OrderedDict()  # Orden de uso: el primero es el menos reciente
+        self._absent = OrderedDict()  # Usuarios sin clasificaciones en disco, mismo orden
+        self._lru_lock = threading.Lock()
+        self._dirty = set()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._cold = ColdStore(path)
+        self._total_users, self._total_ratings, self._joke_counts, self._histogram = self._cold.aggregates()
+
+    def _touch(self, user_id):
+        """Marcar al usuario como el más reciente y contar el acierto"""
+        with self._lru_lock:
+            if user_id in self._users:
+                self._users.move_to_end(user_id)
+            self._hits += 1
+
+    def _fetch(self, user_id):
+        """Clasificaciones del usuario, trayéndolo a memoria si hace falta (con su lock tomado)"""
+        ratings = self._users.get(user_id)
+        if ratings is not None:
+            self._touch(user_id)
+            return ratings
+        with self._lru_lock:
+            if user_id in self._absent:
+                self._absent.move_to_end(user_id)
+                self._hits += 1
+                return None
+        row = self._cold.read(user_id)
+        with self._lru_lock:
+            self._misses += 1
+            if row is not None:
+                self._user_versions[user_id], self._users[user_id] = row
+            else:
+                self._absent[user_id] = None
+                if len(self._absent) > self.max_hot_users:
+                    self._absent.popitem(last=False)
+        return row[1] if row is not None else None
+
+    def _evict_over_limit(self):
+        """Desalojar a los menos recientes hasta volver al límite"""
+        skipped = 0
+        while len(self._users) > self.max_hot_users and skipped < len(self._locks):
+            with self._lru_lock:
+                if len(self._users) <= self.max_hot_users:
+                    return
+                user_id = next(iter(self._users))
+            lock = self._lock_for(user_id)
+            if not lock.acquire(blocking=False):
+                # Usuario en uso: pasarlo al final y probar con el siguiente
+                with self._lru_lock:
+                    if user_id in self._users:
+                        self._users.move_to_end(user_id)
+                skipped += 1
+                continue
+            try:
+                if user_id not in self._users:
+                    continue
+                if user_id in self._dirty:
+                    self._cold.write({user_id: (self._user_versions[user_id], self._users[user_id])})
+                    self._dirty.discard(user_id)
+                with self._lru_lock:
+                    self._users.pop(user_id, None)
+                    self._user_versions.pop(user_id, None)
+                    self._evictions += 1
+            finally:
+                lock.release()
+
+    def get(self, user_id):
+        """Tupla de clasificaciones del usuario (vacía si no tiene)"""
+        ratings = self._users.get(user_id)
+        if ratings is not None:
+            self._touch(user_id)
+            return ratings
+        with self._lock_for(user_id):
+            ratings = self._fetch(user_id)
+        self._evict_over_limit()
+        return ratings or ()
+
+    def user_version(self, user_id):
+        """Número de secuencia de escrituras del usuario (0 si nunca clasificó)"""
+        version = self._user_versions.get(user_id)
+        if version is None:
+            self.get(user_id)
+            version = self._user_versions.get(user_id, 0)
+        return version
+
+    def add(self, user_id, joke_id, rating, timestamp):
+        """Agregar una clasificación; devuelve cuántas quedan guardadas para el usuario"""
+        with self._lock_for(user_id):
+            previous = self._fetch(user_id)
+            ratings = (previous or ()) + ((joke_id, rating, timestamp),)
+            evicted = ratings[:-self.maxlen]
+            ratings = ratings[-self.maxlen:]
+            with self._lru_lock:
+                self._absent.pop(user_id, None)
+                self._users[user_id] = ratings
+                self._users.move_to_end(user_id)
+                self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+            self._dirty.add(user_id)
+            with self._stats_lock:
+                if previous is None:
+                    self._total_users += 1
+                self._count(joke_id, rating, +1)
+                for old_joke_id, old_rating, _ in evicted:
+                    self._count(old_joke_id, old_rating, -1)
+                self._mark_recent()
+        self._evict_over_limit()
+        return len(ratings)
+
+    def load(self, data, chunk_size=1000, versions=None):
+        """Cargar {user_id: [(joke_id, rating, timestamp), ...]} (reemplaza a esos usuarios).
+
+        Se vuelca a disco cada ``chunk_size`` usuarios, así que cargar una
+        instantánea grande no supera el límite de memoria. ``versions``
+        ({user_id: versión} de otro shard) evita que la secuencia de
+        escrituras de un usuario movido vuelva a empezar.
+        """
+        versions = versions or {}
+        for n, (user_id, ratings) in enumerate(data.items(), start=1):
+            ratings = tuple(tuple(r) for r in ratings)[-self.maxlen:]
+            with self._lock_for(user_id):
+                previous = self._fetch(user_id)
+                with self._lru_lock:
+                    self._absent.pop(user_id, None)
+                    self._users[user_id] = ratings
+                    self._user_versions[user_id] = max(self._user_versions.get(user_id, 0) + 1,
+                                                       versions.get(user_id, 0))
+                self._dirty.add(user_id)
+                with self._stats_lock:
+                    if previous is None:
+                        self._total_users += 1
+                    for joke_id, rating, _ in previous or ():
+                        self._count(joke_id, rating, -1)
+                    for joke_id, rating, _ in ratings:
+                        self._count(joke_id, rating, +1)
+            if n % chunk_size == 0:
+                self.flush()
+                self._evict_over_limit()
+        self.flush()
+        self._evict_over_limit()
+
+    def flush(self):
+        """Escribir a disco los usuarios con cambios pendientes; devuelve cuántos se escribieron"""
+        rows = {}
+        for user_id in list(self._dirty):
+            with self._lock_for(user_id):
+                if user_id in self._dirty and user_id in self._users:
+                    rows[user_id] = (self._user_versions[user_id], self._users[user_id])
+        if not rows:
+            return 0
+        self._cold.write(rows)
+        for user_id, (version, _) in rows.items():
+            with self._lock_for(user_id):
+                # Si volvió a cambiar mientras se escribía, sigue pendiente
+                if self._user_versions.get(user_id) == version:
+                    self._dirty.discard(user_id)
+        return len(rows)
+
+    def remove(self, user_ids):
+        """Quitar usuarios de memoria y de disco (p. ej. al moverlos a otro shard); devuelve cuántos había"""
+        removed = 0
+        for user_id in user_ids:
+            with self._lock_for(user_id):
+                ratings = self._fetch(user_id)
+                if ratings is None:
+                    continue
+                with self._lru_lock:
+                    self._users.pop(user_id, None)
+                    self._user_versions.pop(user_id, None)
+                self._dirty.discard(user_id)
+                with self._stats_lock:
+                    self._total_users -= 1
+                    for joke_id, rating, _ in ratings:
+                        self._count(joke_id, rating, -1)
+                removed += 1
+        self._cold.delete(user_ids)
+        return removed
+
+    def iter_users(self):
+        """Clasificaciones de todos los usuarios, en memoria o en disco (p. ej. para moverlos de shard).
+
+        Los cambios pendientes se vuelcan antes de empezar; los que lleguen
+        mientras se recorre pueden no aparecer.
+        """
+        self.flush()
+        yield from self._cold.iter_users()
+
+    def close(self):
+        """Volcar los cambios pendientes y cerrar la base"""
+        self.flush()
+        self._cold.close()
+
+    def __contains__(self, user_id):
+        if user_id in self._users:
+            return True
+        return user_id not in self._absent and self._cold.read(user_id) is not None
+
+    def __len__(self):
+        return self._total_users
+
+    def stats(self, detail=False):
+        """Agregados de ``RatingStore`` sobre todos los usuarios, más aciertos y fallos de la memoria"""
+        result = super().stats(detail=detail)
+        result["total_users"] = self._total_users
+        with self._lru_lock:
+            lookups = self._hits + self._misses
+            result["cache"] = {
+                "hot_users": len(self._users),
+                "absent_users": len(self._absent),
+                "max_hot_users": self.max_hot_users,
+                "pending_writes": len(self._dirty),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+            }
+        return result
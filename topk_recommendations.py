@@ -0,0 +1,205 @@
+"""Tabla precalculada de top-K chistes por usuario conocido por el modelo.
+
+Las predicciones base del SVD solo cambian cuando cambia el modelo, y el
+sesgo de preferencia es un desplazamiento uniforme seguido de un recorte,
+así que nunca reordena los chistes. Por eso el ranking base de cada usuario
+conocido se puede calcular una vez (en varios procesos) y guardar en disco;
+la API solo aplica el sesgo en vivo al servir.
+
+Uso offline:
+    python topk_recommendations.py [--k 50] [--workers 4]
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from scoring import FactorScorer, adjust_rating
+
+TOPK_FILE = "recommendations_topk.npz"
+TOPK_SIZE = int(os.environ.get("TOPK_SIZE", 50))
+CHUNK_SIZE = 1000
+# Con fork los trabajadores heredan el proceso en lugar de volver a importar el módulo principal
+FORK_AVAILABLE = "fork" in multiprocessing.get_all_start_methods()
+
+# Estado de cada proceso trabajador
+_worker_scorer = None
+
+
+def file_fingerprint(path):
+    """Huella corta del contenido de un archivo (versión del modelo)"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def catalog_fingerprint(joke_ids):
+    """Huella del catálogo de chistes disponible"""
+    data = ",".join(str(int(j)) for j in joke_ids).encode()
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def _init_worker(scorer):
+    global _worker_scorer
+    _worker_scorer = scorer
+
+
+def _topk_chunk(user_ids, k):
+    """Calcular el top-K de un bloque de usuarios dentro de un trabajador"""
+    scores = _worker_scorer.score_users(user_ids)
+    # Orden estable: ante empates se respeta el orden del catálogo, como en la API
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    top_scores = np.take_along_axis(scores, order, axis=1)
+    return _worker_scorer.joke_ids[order].astype(np.int32), top_scores.astype(np.float32)
+
+
+class TopKTable:
+    """Tabla compacta en memoria: usuarios ordenados + matrices de ids y puntajes"""
+
+    def __init__(self, user_ids, joke_ids, scores, model_version, catalog_version, catalog_size):
+        self.user_ids = user_ids
+        self.joke_ids = joke_ids
+        self.scores = scores
+        self.model_version = model_version
+        self.catalog_version = catalog_version
+        self.catalog_size = catalog_size
+        self.k = joke_ids.shape[1] if joke_ids.ndim == 2 else 0
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def lookup(self, user_id):
+        """Devolver [(joke_id, base_rating), ...] del usuario o None si no está"""
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos >= len(self.user_ids) or self.user_ids[pos] != user_id:
+            return None
+        return list(zip(self.joke_ids[pos].tolist(), self.scores[pos].tolist()))
+
+    def rank(self, user_id, user_bias, top_n):
+        """[(joke_id, rating ajustado), ...] de la tabla, o None si el usuario no está o pide más de ``k``"""
+        if top_n > self.k:
+            return None
+        precomputed = self.lookup(user_id)
+        if precomputed is None:
+            return None
+        # El sesgo desplaza todos los ratings por igual, así que el orden base se mantiene
+        return [(joke_id, round(adjust_rating(base_rating, user_bias), 3))
+                for joke_id, base_rating in precomputed[:top_n]]
+
+    def save(self, path):
+        # Escribir a un temporal y reemplazar: varias instancias de la API pueden compartir el archivo
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                user_ids=self.user_ids,
+                joke_ids=self.joke_ids,
+                scores=self.scores,
+                model_version=self.model_version,
+                catalog_version=self.catalog_version,
+                catalog_size=self.catalog_size,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["user_ids"],
+                data["joke_ids"],
+                data["scores"],
+                str(data["model_version"]),
+                str(data["catalog_version"]),
+                int(data["catalog_size"]),
+            )
+
+
+def build_table(model, joke_ids, model_version, k=TOPK_SIZE, workers=None):
+    """Calcular el top-K de todos los usuarios conocidos usando varios procesos.
+
+    Los trabajadores se crean con fork donde existe: con spawn o forkserver
+    cada uno volvería a ejecutar el módulo principal, y si es la API eso
+    abre la base, migra archivos y arranca hilos. ``workers=0`` calcula
+    todo en este proceso.
+    """
+    scorer = FactorScorer(model, joke_ids)
+    user_ids = np.array(sorted(u for u in scorer.known_users() if isinstance(u, (int, np.integer))),
+                        dtype=np.int64)
+    k = min(k, len(joke_ids))
+
+    chunks = [user_ids[i:i + CHUNK_SIZE].tolist() for i in range(0, len(user_ids), CHUNK_SIZE)]
+    top_ids = np.empty((len(user_ids), k), dtype=np.int32)
+    top_scores = np.empty((len(user_ids), k), dtype=np.float32)
+
+    def store(results):
+        for i, (ids, scores) in enumerate(results):
+            start = i * CHUNK_SIZE
+            top_ids[start:start + len(ids)] = ids
+            top_scores[start:start + len(ids)] = scores
+
+    if workers == 0:
+        _init_worker(scorer)
+        store(_topk_chunk(chunk, k) for chunk in chunks)
+    else:
+        context = multiprocessing.get_context("fork") if FORK_AVAILABLE else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(scorer,)) as pool:
+            store(pool.map(_topk_chunk, chunks, [k] * len(chunks)))
+
+    return TopKTable(user_ids, top_ids, top_scores, model_version,
+                     catalog_fingerprint(joke_ids), len(joke_ids))
+
+
+def load_or_build(model, joke_ids, model_version, path=TOPK_FILE, k=TOPK_SIZE, workers=None):
+    """Reutilizar la tabla en disco si corresponde al modelo y catálogo actuales, si no recalcularla"""
+    if not FactorScorer.supports(model):
+        print("⚠️ El modelo no expone factores SVD; se omite la tabla top-K")
+        return None
+
+    expected_k = min(k, len(joke_ids))
+    if os.path.exists(path):
+        try:
+            table = TopKTable.load(path)
+            if (table.model_version == model_version
+                    and table.catalog_version == catalog_fingerprint(joke_ids)
+                    and table.k == expected_k):
+                print(f"✅ Tabla top-{table.k} cargada desde {path} ({len(table)} usuarios)")
+                return table
+        except Exception as e:
+            print(f"⚠️ Error cargando tabla top-K: {e}")
+
+    start = time.time()
+    table = build_table(model, joke_ids, model_version, k=k, workers=workers)
+    try:
+        table.save(path)
+    except Exception as e:
+        print(f"❌ Error guardando tabla top-K: {e}")
+    print(f"✅ Tabla top-{table.k} calculada para {len(table)} usuarios en {time.time() - start:.1f}s")
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcular el top-K de chistes por usuario")
+    parser.add_argument("--model", default="svd_model2.pkl")
+    parser.add_argument("--jokes", default="jokes.csv")
+    parser.add_argument("--output", default=TOPK_FILE)
+    parser.add_argument("--k", type=int, default=TOPK_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.model, "rb") as f:
+        model = pickle.load(f)
+    joke_ids = pd.read_csv(args.jokes)["joke_id"].tolist()
+
+    if os.path.exists(args.output):
+        os.remove(args.output)
+    load_or_build(model, joke_ids, file_fingerprint(args.model),
+                  path=args.output, k=args.k, workers=args.workers)
@@ -0,0 +1,208 @@
+"""Reentrenamiento local del modelo a partir de las clasificaciones guardadas.
+
+Lee el historial (``ratings_log.ndjson`` y, opcionalmente, archivos CSV o
+NDJSON adicionales con columnas user_id, joke_id, rating) línea por línea,
+entrena una factorización matricial con sesgos (media + b_u + b_i + p_u·q_i)
+por mínimos cuadrados alternados (ALS) repartiendo los bloques de usuarios
+y de chistes entre varios procesos, y guarda un artefacto que la API carga
+igual que ``svd_model2.pkl``.
+
+Uso:
+    python train_model.py [--ratings ratings_log.ndjson ...] [--factors 20]
+                          [--iterations 15] [--workers 4] [--output svd_model2.pkl]
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import pickle
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scoring import RATING_MAX, RATING_MIN, MatrixFactorizationModel
+
+RATINGS_LOG_FILE = "ratings_log.ndjson"
+MODEL_FILE = "svd_model2.pkl"
+
+
+def iter_ratings(path):
+    """Recorrer (user_id, joke_id, rating) de un archivo NDJSON o CSV sin cargarlo entero"""
+    with open(path, "r", newline="") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield int(row["user_id"]), int(row["joke_id"]), float(row["rating"])
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                yield int(record["user_id"]), int(record["joke_id"]), float(record["rating"])
+
+
+def is_holdout(user_id, joke_id, fraction, seed):
+    """Asignación determinística de un par (usuario, chiste) al conjunto de prueba"""
+    key = f"{seed}:{user_id}:{joke_id}".encode()
+    bucket = int.from_bytes(hashlib.md5(key).digest()[:4], "little") / 2 ** 32
+    return bucket < fraction
+
+
+def load_ratings(paths):
+    """Cargar las clasificaciones quedándose con la última de cada par (usuario, chiste)"""
+    latest = {}
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"⚠️ No se encontró {path}, se omite")
+            continue
+        for user_id, joke_id, rating in iter_ratings(path):
+            latest[(user_id, joke_id)] = rating
+    return latest
+
+
+def split_ratings(latest, holdout, seed):
+    """Separar en arreglos compactos de entrenamiento y prueba"""
+    train = (array("q"), array("q"), array("d"))
+    test = (array("q"), array("q"), array("d"))
+    for (user_id, joke_id), rating in latest.items():
+        target = test if holdout > 0 and is_holdout(user_id, joke_id, holdout, seed) else train
+        target[0].append(user_id)
+        target[1].append(joke_id)
+        target[2].append(rating)
+    return ([np.frombuffer(a, dtype=a.typecode) for a in train[:2]] + [np.frombuffer(train[2])],
+            [np.frombuffer(a, dtype=a.typecode) for a in test[:2]] + [np.frombuffer(test[2])])
+
+
+def to_csr(rows, cols, values, n_rows):
+    """Agrupar las clasificaciones por fila (usuario o chiste) en formato CSR"""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order], values[order]
+
+
+def _solve_block(indptr, indices, values, other_factors, other_bias, global_mean, reg):
+    """Resolver sesgo y factores de un bloque de filas con los de la otra dimensión fijos"""
+    n_rows = len(indptr) - 1
+    k = other_factors.shape[1]
+    factors = np.zeros((n_rows, k))
+    bias = np.zeros(n_rows)
+    identity = np.eye(k + 1)
+    for row in range(n_rows):
+        start, end = indptr[row], indptr[row + 1]
+        if start == end:
+            continue
+        idx = indices[start:end]
+        X = np.empty((end - start, k + 1))
+        X[:, 0] = 1.0
+        X[:, 1:] = other_factors[idx]
+        y = values[start:end] - global_mean - other_bias[idx]
+        # Regularización ponderada por cantidad de clasificaciones (ALS-WR)
+        w = np.linalg.solve(X.T @ X + reg * (end - start) * identity, X.T @ y)
+        bias[row] = w[0]
+        factors[row] = w[1:]
+    return factors, bias
+
+
+def _solve_side(pool, csr, other_factors, other_bias, global_mean, reg, n_blocks):
+    """Repartir las filas en bloques contiguos entre los procesos y unir los resultados"""
+    indptr, indices, values = csr
+    n_rows = len(indptr) - 1
+    bounds = np.linspace(0, n_rows, n_blocks + 1).astype(int)
+    futures = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if lo == hi:
+            continue
+        start, end = indptr[lo], indptr[hi]
+        futures.append(pool.submit(
+            _solve_block, indptr[lo:hi + 1] - start, indices[start:end], values[start:end],
+            other_factors, other_bias, global_mean, reg
+        ))
+    results = [f.result() for f in futures]
+    return np.vstack([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def rmse(model, users, jokes, ratings):
+    """Error cuadrático medio del modelo sobre un conjunto de clasificaciones"""
+    if len(ratings) == 0:
+        return None
+    errors = [model.estimate(int(u), int(j)) - r for u, j, r in zip(users, jokes, ratings)]
+    return float(np.sqrt(np.mean(np.square(errors))))
+
+
+def train(users, jokes, ratings, n_factors=20, iterations=15, reg=0.1, workers=None, seed=0):
+    """Entrenar el modelo por ALS en paralelo; devuelve un MatrixFactorizationModel"""
+    user_ids, user_rows = np.unique(users, return_inverse=True)
+    joke_ids, joke_rows = np.unique(jokes, return_inverse=True)
+    global_mean = float(ratings.mean())
+
+    by_user = to_csr(user_rows, joke_rows, ratings, len(user_ids))
+    by_joke = to_csr(joke_rows, user_rows, ratings, len(joke_ids))
+
+    rng = np.random.default_rng(seed)
+    pu = rng.normal(0, 0.1, (len(user_ids), n_factors))
+    qi = rng.normal(0, 0.1, (len(joke_ids), n_factors))
+    bu = np.zeros(len(user_ids))
+    bi = np.zeros(len(joke_ids))
+
+    workers = workers or os.cpu_count() or 1
+    n_blocks = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in range(iterations):
+            pu, bu = _solve_side(pool, by_user, qi, bi, global_mean, reg, n_blocks)
+            qi, bi = _solve_side(pool, by_joke, pu, bu, global_mean, reg, n_blocks)
+
+    return MatrixFactorizationModel(
+        global_mean,
+        [int(u) for u in user_ids],
+        [int(j) for j in joke_ids],
+        bu, bi, pu, qi,
+        rating_scale=(RATING_MIN, RATING_MAX)
+    )
+
+
+def save_model(model, path):
+    """Guardar el artefacto reemplazando el anterior de forma atómica"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(model, f)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reentrenar el modelo de recomendación con las clasificaciones guardadas")
+    parser.add_argument("--ratings", nargs="+", default=[RATINGS_LOG_FILE],
+                        help="Archivos NDJSON o CSV con user_id, joke_id y rating")
+    parser.add_argument("--output", default=MODEL_FILE)
+    parser.add_argument("--factors", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=15)
+    parser.add_argument("--reg", type=float, default=0.1)
+    parser.add_argument("--holdout", type=float, default=0.1, help="Fracción de pares reservada para medir RMSE")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("📥 Leyendo clasificaciones...")
+    latest = load_ratings(args.ratings)
+    train_set, test_set = split_ratings(latest, args.holdout, args.seed)
+    del latest
+    if len(train_set[2]) == 0:
+        raise SystemExit("❌ No hay clasificaciones para entrenar")
+    print(f"📊 {len(train_set[2])} clasificaciones de entrenamiento, {len(test_set[2])} de prueba")
+
+    start = time.time()
+    model = train(*train_set, n_factors=args.factors, iterations=args.iterations,
+                  reg=args.reg, workers=args.workers, seed=args.seed)
+    elapsed = time.time() - start
+
+    print(f"⏱️ Entrenamiento: {elapsed:.1f}s ({len(model.user_index)} usuarios, {len(model.item_index)} chistes)")
+    print(f"📉 RMSE entrenamiento: {rmse(model, *train_set):.4f}")
+    test_rmse = rmse(model, *test_set)
+    if test_rmse is not None:
+        print(f"📉 RMSE prueba: {test_rmse:.4f}")
+
+    save_model(model, args.output)
+    print(f"💾 Modelo guardado en {args.output}")